@@ -1,18 +1,210 @@
-import cv2
-import pyautogui
 import time
 import os
 import random
 import json
-import pytesseract
-import win32gui
-import win32con
+import importlib
+import importlib.util
 import shutil
 import hashlib
-import requests  # 网络请求库，用于远程更新
+import difflib
+import re
+import sqlite3
+import sys
+import threading
+import atexit
+import queue
+import csv
+import gzip
+import mmap
+import struct
+import io
+import contextlib
+import math
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # 配置OCR路径（根据你的Tesseract安装路径调整）
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+class HeadlessInputError(RuntimeError):
+    """批量模式下指令需要交互输入，但没有配置默认值"""
+
+class DownloadInterrupted(IOError):
+    """下载未完整结束（连接提前关闭或续传位置不对），可以重试续传"""
+
+class LazyModule:
+    """延迟导入：第一次访问模块属性时才真正导入，缩短启动时间"""
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import:
+                        self._on_import(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def configure_tesseract(module):
+    module.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+cv2 = LazyModule("cv2")
+pyautogui = LazyModule("pyautogui")
+pytesseract = LazyModule("pytesseract", configure_tesseract)
+win32gui = LazyModule("win32gui")
+win32con = LazyModule("win32con")
+requests = LazyModule("requests")  # 网络请求库，用于远程更新
+
+# ========== 启动配置 ==========
+STARTUP_CONFIG = {
+    "fast_start": False  # 快速启动：检查更新、回顾历史和自我反思放到后台线程执行，并跳过演示用的等待
+}
+
+# ========== 无人值守批量模式配置 ==========
+HEADLESS_CONFIG = {
+    "confirm_policy": "no",  # 模糊识别到指令时的自动确认：yes 执行 / no 跳过
+    "learn": False,          # 题库未命中时是否进入自动学习（需要截图和手动输入，批量模式默认关闭）
+    "quiet": True,           # 隐藏每条输入的处理过程输出，只打印结果报告
+    # 需要输入的指令在批量模式下使用的默认输入；没有配置的指令会报 needs_input 并跳过，不会读取标准输入
+    "input_defaults": {
+        "clear_question_bank": "",  # 不清空题库
+        "preprocess_steps": "",     # 不修改预处理步骤
+        "export_path": ""           # 取消导出
+    }
+}
+
+# ========== 性能监测配置 ==========
+METRICS_CONFIG = {
+    "enabled": True,    # 记录各阶段耗时（截图、PNG保存、预处理、OCR、查题、点击等待、点击、落盘）
+    "sink_file": None   # 设置后每次计时额外追加一行JSON到该文件（相对根目录），便于离线分析
+}
+
+# 各阶段在性能报告中的名称
+METRIC_LABELS = {
+    "capture": "截图",
+    "png_save": "PNG保存",
+    "preprocess": "图像预处理",
+    "ocr": "OCR识别",
+    "lookup": "题库精确匹配",
+    "fuzzy_lookup": "题库容错匹配",
+    "click_delay": "点击前随机等待",
+    "click": "鼠标移动和点击",
+    "persist": "数据落盘",
+    "answer_cycle": "单次答题（截图→识别→查题→点击）"
+}
+
+class LatencyHistogram:
+    """按对数分桶的耗时直方图：内存固定，分位数误差不超过一个桶宽（约20%）"""
+
+    MIN_MS = 0.01
+    FACTOR = 1.2
+    BUCKETS = 100  # 覆盖 0.01 ms ~ 约 13 分钟
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+
+    def add(self, ms):
+        if ms <= self.MIN_MS:
+            index = 0
+        else:
+            index = min(self.BUCKETS - 1, int(math.log(ms / self.MIN_MS) / math.log(self.FACTOR)) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def percentile(self, pct):
+        """取累计计数达到 pct 的桶的上界，并限制在实际最小/最大值之间"""
+        if not self.count:
+            return 0.0
+        target = pct * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                upper = self.MIN_MS * self.FACTOR ** index
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max
+        }
+
+class Metrics:
+    """各阶段的耗时统计：span() 计时并记入直方图，可选把每次计时追加到JSONL文件"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.sink = None
+        self.sink_path = None
+        atexit.register(self.close)
+
+    def open_sink(self, path):
+        with self.lock:
+            if self.sink is not None:
+                self.sink.close()
+            # 行缓冲：每条计时写完即落盘，进程被强制结束也不会丢失缓冲区里的记录
+            self.sink = open(path, 'a', encoding='utf-8', buffering=1)
+            self.sink_path = path
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        ms = seconds * 1000
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.add(ms)
+            if self.sink is not None:
+                self.sink.write(json.dumps({"ts": round(time.time(), 3), "stage": stage, "ms": round(ms, 3)}) + "\n")
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def summary(self):
+        with self.lock:
+            return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def close(self):
+        with self.lock:
+            if self.sink is not None:
+                self.sink.flush()
+                self.sink.close()
+                self.sink = None
+
+metrics = Metrics(METRICS_CONFIG["enabled"])
 
 # ========== 远程更新核心配置（替换成你的GitHub仓库地址） ==========
 UPDATE_CONFIG = {
@@ -21,36 +213,2147 @@ UPDATE_CONFIG = {
     "version_check_url": "https://raw.githubusercontent.com/jxjx24no/douxing-ai/main/version.json",
     "backup_dir": os.path.join(os.path.dirname(os.path.abspath(__file__)), "backups"),
     "auto_check_update": True,
-    "timeout": 10  # 网络请求超时时间
+    "timeout": 10,  # 网络请求超时时间
+    "recheck_interval": 3600,  # 自动检查的最短间隔（秒），间隔内直接使用本地缓存的版本信息
+    "cache_file": "update_cache.json",  # 上次版本信息响应的本地缓存（含ETag/Last-Modified）
+    "download_chunk_size": 64 * 1024,  # 流式下载每块大小（字节）
+    "download_retries": 3,  # 下载中断后断点续传的重试次数
+    "backup_keep": 10  # 备份库最多保留的版本数（按备份时间，最新的优先保留）
 }
 
+def version_to_num(version):
+    """版本号比较（x.y格式）；备份库中的 <版本>@<哈希> 别名按其版本号比较"""
+    parts = version.split('@')[0].split('.')
+    return int(parts[0]) * 100 + int(parts[1]) if len(parts)>=2 else int(parts[0])
+
+class UpdateChecker:
+    """版本信息检查：复用连接池，带ETag/If-Modified-Since条件请求和本地缓存"""
+
+    def __init__(self, url, cache_file, timeout=10, recheck_interval=3600):
+        self.url = url
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.recheck_interval = recheck_interval
+        self.lock = threading.Lock()
+        self._session = None
+        self.cache = {}
+        try:
+            if os.path.exists(cache_file):
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    self.cache = json.load(f)
+        except:
+            self.cache = {}
+
+    def session(self):
+        """所有更新请求共用一个Session，保持长连接"""
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def save_cache(self):
+        try:
+            atomic_write_json(self.cache_file, self.cache)
+        except Exception as e:
+            print(f"⚠️ 更新缓存保存失败：{e}")
+
+    def fetch(self, force=False):
+        """返回 {"info", "source", "status_code"}；source 为 cache / not_modified / network / error"""
+        with self.lock:
+            now = time.time()
+            body = self.cache.get("body")
+            if not force and body and now - self.cache.get("checked_at", 0) < self.recheck_interval:
+                return {"info": json.loads(body), "source": "cache", "status_code": None}
+            
+            headers = {}
+            if body:
+                if self.cache.get("etag"):
+                    headers["If-None-Match"] = self.cache["etag"]
+                if self.cache.get("last_modified"):
+                    headers["If-Modified-Since"] = self.cache["last_modified"]
+            response = self.session().get(self.url, headers=headers, timeout=self.timeout)
+            
+            if response.status_code == 304 and body:
+                self.cache["checked_at"] = now
+                self.save_cache()
+                return {"info": json.loads(body), "source": "not_modified", "status_code": 304}
+            if response.status_code != 200:
+                return {"info": None, "source": "error", "status_code": response.status_code}
+            
+            info = json.loads(response.text)
+            self.cache = {
+                "body": response.text,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked_at": now
+            }
+            self.save_cache()
+            return {"info": info, "source": "network", "status_code": 200}
+
+# 增量更新补丁：按行对比新旧文件，补丁只保存"复制旧文件第i1~i2行"和新增的文本
+PATCH_FORMAT = "douxing-linediff-1"
+
+def make_line_patch(old_data, new_data):
+    """生成从 old_data 到 new_data 的行级补丁（bytes → bytes）"""
+    old_lines = old_data.splitlines(keepends=True)
+    new_lines = new_data.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(b"".join(new_lines[j1:j2]).decode("utf-8", "surrogateescape"))
+    return json.dumps({"format": PATCH_FORMAT, "ops": ops}).encode("ascii")
+
+def apply_line_patch(old_data, patch_data):
+    """把补丁应用到 old_data，返回新文件内容（bytes）"""
+    patch = json.loads(patch_data.decode("ascii"))
+    if patch.get("format") != PATCH_FORMAT:
+        raise ValueError(f"不支持的补丁格式：{patch.get('format')}")
+    old_lines = old_data.splitlines(keepends=True)
+    parts = []
+    for op in patch["ops"]:
+        if isinstance(op, list):
+            parts.extend(old_lines[op[0]:op[1]])
+        else:
+            parts.append(op.encode("utf-8", "surrogateescape"))
+    return b"".join(parts)
+
+class BackupStore:
+    """按内容寻址的版本备份库：objects/<sha256>.py 保存文件内容，index.json 记录 版本 → 哈希。
+    相同内容只存一份，超出保留数量的版本会被清理；同一版本号再次备份出不同内容时，
+    旧内容改记为 <版本>@<哈希前8位>，不会被覆盖"""
+
+    def __init__(self, root, keep=10):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_file = os.path.join(root, "index.json")
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.index = {}
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self.index = json.load(f)
+        except:
+            self.index = {}
+        self.import_legacy_backups()
+
+    def import_legacy_backups(self):
+        """把旧版按时间戳命名的备份（douxing_core_<版本>_<时间戳>.py）收进备份库"""
+        if not os.path.isdir(self.root):
+            return
+        legacy = []
+        for name in os.listdir(self.root):
+            match = re.match(r"douxing_core_(.+)_(\d+)\.py$", name)
+            if match:
+                legacy.append((int(match.group(2)), match.group(1), os.path.join(self.root, name)))
+        for _, version, path in sorted(legacy):
+            self.backup(version, path)
+            os.remove(path)
+
+    def object_path(self, file_hash):
+        return os.path.join(self.objects_dir, f"{file_hash}.py")
+
+    def backup(self, version, source_path, protect=()):
+        """备份 source_path 为 version；返回 (哈希, 是否新写入了对象)。
+        protect 中哈希对应的备份本次不参与清理（例如回滚前备份当前文件时，要回滚到的目标版本）"""
+        with self.lock:
+            with open(source_path, "rb") as f:
+                data = f.read()
+            file_hash = hashlib.sha256(data).hexdigest()
+            object_path = self.object_path(file_hash)
+            created = not os.path.exists(object_path)
+            if created:
+                os.makedirs(self.objects_dir, exist_ok=True)
+                tmp_path = object_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, object_path)
+            previous = self.index.get(version)
+            if previous is not None and previous["hash"] != file_hash:
+                # 版本号相同但内容不同（本地改过或同版本号重新发布）：旧内容原位改名保留，
+                # 条目里的 version 仍是原版本号，回滚到别名时按原版本号记录
+                alias = f"{version}@{previous['hash'][:8]}"
+                previous.setdefault("version", version)
+                self.index = {(alias if key == version else key): entry for key, entry in self.index.items()}
+            self.index.pop(version, None)  # 重新插入到末尾，index 按备份先后排列
+            self.index[version] = {"hash": file_hash, "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                                   "size": len(data), "version": version}
+            self.prune(protect)
+            atomic_write_json(self.index_file, self.index)
+            return file_hash, created
+
+    def prune(self, protect=()):
+        """只保留最近备份的 keep 个版本，并删除不再被引用的对象；protect 中哈希对应的备份不会被清理"""
+        if self.keep and len(self.index) > self.keep:
+            candidates = [version for version, entry in self.index.items() if entry["hash"] not in protect]
+            for version in candidates[:len(self.index) - self.keep]:
+                del self.index[version]
+        referenced = {entry["hash"] for entry in self.index.values()}
+        if os.path.isdir(self.objects_dir):
+            for name in os.listdir(self.objects_dir):
+                if name.endswith(".py") and name[:-3] not in referenced:
+                    os.remove(os.path.join(self.objects_dir, name))
+
+    def versions(self):
+        """最近备份的版本在前"""
+        return list(reversed(self.index.items()))
+
+    def restore(self, version, target_path):
+        """把 version 的备份原子替换到 target_path；返回恢复的文件哈希"""
+        with self.lock:
+            entry = self.index.get(version)
+            if not entry:
+                raise KeyError(f"备份库中没有版本 {version}")
+            object_path = self.object_path(entry["hash"])
+            tmp_path = target_path + ".restore"
+            shutil.copyfile(object_path, tmp_path)
+            if self.hash_file(tmp_path) != entry["hash"]:
+                os.remove(tmp_path)
+                raise IOError(f"版本 {version} 的备份已损坏")
+            os.replace(tmp_path, target_path)
+            return entry["hash"]
+
+    def label_of(self, file_hash):
+        """内容哈希对应的备份标签（版本号或别名），不存在时返回 None"""
+        for label, entry in self.index.items():
+            if entry["hash"] == file_hash:
+                return label
+        return None
+
+    def version_of(self, label):
+        """备份条目对应的版本号：别名 <版本>@<哈希> 返回 <版本>"""
+        entry = self.index.get(label) or {}
+        return entry.get("version", label.split("@")[0])
+
+    @staticmethod
+    def hash_file(path):
+        sha256_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(64 * 1024), b""):
+                sha256_hash.update(block)
+        return sha256_hash.hexdigest()
+
+# ========== 题目匹配配置 ==========
+MATCH_CONFIG = {
+    "fuzzy_enabled": True,     # 精确匹配失败时启用容错匹配（应对OCR错字）
+    "fuzzy_threshold": 0.5,    # 相似度低于该值的候选不采用
+    "fuzzy_top_k": 3,          # 返回的候选数量
+    "fuzzy_max_postings": 2000, # 出现次数超过该值的高频字组不参与候选召回
+    "fuzzy_min_key_length": 5,  # 短于该长度的题目只做精确匹配，错一个字就可能是另一道题
+    "fuzzy_min_bigrams": 2,     # 题目至少要有这么多个二元组出现在文本中
+    "fuzzy_error_rate": 0.2,    # 允许的错字比例：题目长度 × 该值（向下取整）即允许的错字数，10个字最多错2个
+    "fuzzy_margin": 0.05        # 最佳候选的相似度至少领先答案不同的次佳候选这么多，否则视为无法确定
+}
+
+# ========== 存储后端配置 ==========
+STORAGE_CONFIG = {
+    "backend": "json",               # json：沿用原有JSON文件；sqlite：上下文记忆/反思日志/版本历史存入带索引的SQLite
+    "sqlite_file": "douxing_store.db"
+}
+
+# ========== 延迟写入配置 ==========
+PERSIST_CONFIG = {
+    "flush_interval": 5,    # 后台每隔多少秒写入一次有变更的数据（秒）
+    "flush_threshold": 50   # 累计变更达到该次数时立即写入
+}
+
+def atomic_write_json(path, data):
+    """先写临时文件并fsync，再原子替换原文件，避免写到一半崩溃导致文件损坏"""
+    temp_path = path + ".tmp"
+    with metrics.span("persist"):
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+@contextlib.contextmanager
+def file_lock(path, timeout=10.0, stale_after=60.0):
+    """跨进程文件锁：独占创建 <path>.lock，持有超过 stale_after 秒的锁视为进程崩溃残留并清除"""
+    lock_path = path + ".lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # 锁刚被释放
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"等待文件锁超时：{lock_path}")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+class WriteBehindWriter:
+    """合并写入：保存请求只标记为脏，按时间间隔、变更次数阈值或退出时统一落盘"""
+
+    def __init__(self, interval=5, threshold=50):
+        self.interval = interval
+        self.threshold = threshold
+        self.stores = {}
+        self.dirty = {}
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        atexit.register(self.flush)
+
+    def register(self, name, path, snapshot, write=None):
+        """snapshot 返回要写入的数据快照；write(path, data) 自定义落盘方式，默认原子写入JSON"""
+        with self.lock:
+            self.stores[name] = (path, snapshot, write or atomic_write_json)
+            self.dirty.setdefault(name, 0)
+
+    def mark_dirty(self, name):
+        with self.lock:
+            self.dirty[name] = self.dirty.get(name, 0) + 1
+            over_threshold = self.dirty[name] >= self.threshold
+        if over_threshold:
+            self.flush(name)
+        else:
+            self._ensure_thread()
+
+    def pending(self):
+        with self.lock:
+            return {name: count for name, count in self.dirty.items() if count}
+
+    def flush(self, name=None, verbose=False):
+        """立即写入有变更的数据，返回本次写入的存储名称列表"""
+        written = []
+        with self.lock:
+            names = [name] if name else list(self.stores)
+            for store_name in names:
+                if not self.dirty.get(store_name):
+                    continue
+                path, snapshot, write = self.stores[store_name]
+                try:
+                    write(path, snapshot())
+                    self.dirty[store_name] = 0
+                    written.append(store_name)
+                    if verbose:
+                        print(f"💾 已写入：{path}")
+                except Exception as e:
+                    print(f"❌ {os.path.basename(path)} 写入失败：{e}")
+        return written
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="douxing-writer", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while not self.wakeup.wait(self.interval):
+            self.flush()
+
+# ========== SQLite 记录存储 ==========
+class SQLiteRecordStore:
+    """上下文记忆、反思日志、版本历史共用的SQLite存储，每类记录一张表"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def table(self, name, time_field="timestamp", migrate_from=None):
+        """打开（必要时创建）一张记录表，首次使用时从旧JSON文件迁移"""
+        with self.lock:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "timestamp TEXT, type TEXT, category TEXT, payload TEXT NOT NULL)"
+            )
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_category ON {name} (category, timestamp)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_type ON {name} (type, timestamp)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_timestamp ON {name} (timestamp)")
+            self.conn.commit()
+        records = SQLiteRecordList(self, name, time_field)
+        if migrate_from and not len(records) and os.path.exists(migrate_from):
+            try:
+                with open(migrate_from, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                records.extend(entries)
+                os.replace(migrate_from, migrate_from + ".migrated")
+                print(f"📦 已将 {os.path.basename(migrate_from)} 的 {len(entries)} 条记录迁移到SQLite")
+            except Exception as e:
+                print(f"⚠️ {os.path.basename(migrate_from)} 迁移失败：{e}")
+        return records
+
+class SQLiteRecordList:
+    """SQLite表的列表视图：支持 append/len/迭代/下标，并提供走索引的条件查询"""
+
+    def __init__(self, store, name, time_field):
+        self.store = store
+        self.name = name
+        self.time_field = time_field
+        with store.lock:
+            self._count = store.conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    def _row(self, entry):
+        return (entry.get(self.time_field), entry.get("type"), entry.get("category"),
+                json.dumps(entry, ensure_ascii=False))
+
+    def append(self, entry):
+        with self.store.lock:
+            self.store.conn.execute(
+                f"INSERT INTO {self.name} (timestamp, type, category, payload) VALUES (?, ?, ?, ?)",
+                self._row(entry)
+            )
+            self.store.conn.commit()
+            self._count += 1
+
+    def extend(self, entries):
+        rows = [self._row(entry) for entry in entries]
+        with self.store.lock:
+            self.store.conn.executemany(
+                f"INSERT INTO {self.name} (timestamp, type, category, payload) VALUES (?, ?, ?, ?)", rows
+            )
+            self.store.conn.commit()
+            self._count += len(rows)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        with self.store.lock:
+            rows = self.store.conn.execute(f"SELECT payload FROM {self.name} ORDER BY id").fetchall()
+        for (payload,) in rows:
+            yield json.loads(payload)
+
+    def __getitem__(self, index):
+        if index < 0:
+            sql = f"SELECT payload FROM {self.name} ORDER BY id DESC LIMIT 1 OFFSET ?"
+            offset = -index - 1
+        else:
+            sql = f"SELECT payload FROM {self.name} ORDER BY id LIMIT 1 OFFSET ?"
+            offset = index
+        with self.store.lock:
+            row = self.store.conn.execute(sql, (offset,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return json.loads(row[0])
+
+    def _where(self, categories=None, types=None, since=None, until=None):
+        clauses, params = [], []
+        if categories:
+            clauses.append(f"category IN ({','.join('?' * len(categories))})")
+            params.extend(categories)
+        if types:
+            clauses.append(f"type IN ({','.join('?' * len(types))})")
+            params.extend(types)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp <= ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, categories=None, types=None, since=None, until=None, limit=None):
+        where, params = self._where(categories, types, since, until)
+        sql = f"SELECT payload FROM {self.name}{where} ORDER BY id"
+        if limit:
+            sql = f"SELECT payload FROM (SELECT id, payload FROM {self.name}{where} ORDER BY id DESC LIMIT {int(limit)}) ORDER BY id"
+        with self.store.lock:
+            rows = self.store.conn.execute(sql, params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def count(self, categories=None, types=None, since=None, until=None):
+        where, params = self._where(categories, types, since, until)
+        with self.store.lock:
+            return self.store.conn.execute(f"SELECT COUNT(*) FROM {self.name}{where}", params).fetchone()[0]
+
+# ========== 上下文记忆分层配置（JSON后端） ==========
+MEMORY_CONFIG = {
+    "hot_size": 1000,        # 内存和 context_memory.json 中保留的最近记录数
+    "segment_size": 1000,    # 超出后每攒够这么多条旧记录，压缩归档为一个分段
+    "archive_dir": "memory_archive",
+    "stats_file": "context_memory_stats.json"  # 按类别/类型的累计计数和归档分段索引
+}
+
+class TieredMemory:
+    """分层上下文记忆：最近的记录留在内存，更早的记录按分段gzip压缩归档；
+    按类别/类型的计数在追加时增量维护，统计不需要扫描历史"""
+
+    def __init__(self, archive_dir, hot_size, segment_size, entries, stats=None):
+        self.archive_dir = archive_dir
+        self.hot_size = hot_size
+        self.segment_size = segment_size
+        self.lock = threading.RLock()
+        self.hot = deque(entries)
+        on_disk = self._segment_files()
+        if stats is None:
+            # 首次使用或计数文件丢失：由已有归档分段和现有记录重建计数
+            stats = {"total": 0, "categories": {}, "types": {}, "segments": []}
+            for name in on_disk:
+                self._add_segment(stats, name, self.read_segment({"file": name}))
+            for entry in self.hot:
+                self._count_entry(stats, entry)
+        self._stats = stats
+        # 新分段编号接在磁盘上和计数里已有的分段之后，绝不覆盖已归档的分段
+        names = on_disk + [meta["file"] for meta in stats["segments"]]
+        self.next_segment = max((self._segment_number(name) for name in names), default=-1) + 1
+        self.roll()
+
+    def _segment_files(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name for name in os.listdir(self.archive_dir)
+                      if name.startswith("segment_") and name.endswith(".json.gz")
+                      and self._segment_number(name) >= 0)
+
+    @staticmethod
+    def _segment_number(name):
+        number = name[len("segment_"):-len(".json.gz")]
+        return int(number) if number.isdigit() else -1
+
+    @classmethod
+    def _add_segment(cls, stats, name, segment):
+        stats["segments"].append({
+            "file": name,
+            "first": segment[0].get("timestamp", "") if segment else "",
+            "last": segment[-1].get("timestamp", "") if segment else "",
+            "count": len(segment)
+        })
+        for entry in segment:
+            cls._count_entry(stats, entry)
+
+    @staticmethod
+    def _count_entry(stats, entry):
+        stats["total"] += 1
+        category = entry.get("category", "general")
+        stats["categories"][category] = stats["categories"].get(category, 0) + 1
+        memory_type = entry.get("type", "user")
+        stats["types"][memory_type] = stats["types"].get(memory_type, 0) + 1
+
+    def append(self, entry):
+        """追加一条记录；返回本次是否有记录被归档"""
+        with self.lock:
+            self.hot.append(entry)
+            self._count_entry(self._stats, entry)
+            return self.roll()
+
+    def roll(self):
+        """热数据超过 hot_size + segment_size 时，把最旧的 segment_size 条写成一个压缩分段"""
+        archived = False
+        with self.lock:
+            while len(self.hot) > self.hot_size + self.segment_size:
+                segment = [self.hot.popleft() for _ in range(self.segment_size)]
+                self._write_segment(segment)
+                archived = True
+        return archived
+
+    def _write_segment(self, segment):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        name = f"segment_{self.next_segment:06d}.json.gz"
+        self.next_segment += 1
+        path = os.path.join(self.archive_dir, name)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(segment, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self._stats["segments"].append({
+            "file": name,
+            "first": segment[0].get("timestamp", ""),
+            "last": segment[-1].get("timestamp", ""),
+            "count": len(segment)
+        })
+
+    def read_segment(self, meta):
+        with gzip.open(os.path.join(self.archive_dir, meta["file"]), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def __len__(self):
+        return len(self.hot)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __getitem__(self, index):
+        with self.lock:
+            return self.hot[index]
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.hot)
+
+    def stats(self):
+        with self.lock:
+            return json.loads(json.dumps(self._stats))
+
+    def count(self, categories=None, types=None):
+        """累计条数（含已归档），直接读计数器"""
+        with self.lock:
+            if categories:
+                return sum(self._stats["categories"].get(c, 0) for c in categories)
+            if types:
+                return sum(self._stats["types"].get(t, 0) for t in types)
+            return self._stats["total"]
+
+    def query(self, categories=None, types=None, since=None, until=None, include_archive=True):
+        """按条件筛选；include_archive 时只读取时间范围有交集的归档分段"""
+        def keep(entry):
+            timestamp = entry.get("timestamp", "")
+            return ((not categories or entry.get("category") in categories)
+                    and (not types or entry.get("type") in types)
+                    and (not since or timestamp >= since)
+                    and (not until or timestamp <= until))
+        
+        with self.lock:
+            segments = list(self._stats["segments"]) if include_archive else []
+            hot = list(self.hot)
+        result = []
+        for meta in segments:
+            if (since and meta["last"] < since) or (until and meta["first"] > until):
+                continue
+            result.extend(entry for entry in self.read_segment(meta) if keep(entry))
+        result.extend(entry for entry in hot if keep(entry))
+        return result
+
+# ========== 截图后端配置 ==========
+CAPTURE_CONFIG = {
+    "backend": "screen",          # screen：截取屏幕/游戏窗口；replay：回放图片文件（无桌面环境下调试和压测）
+    "replay_source": None,        # 回放用的图片文件或目录
+    "replay_loop": True,          # 回放完后是否从头循环
+    "save_debug_screenshot": False,  # 是否把每帧截图保存到磁盘（调试用）
+    "debug_screenshot_name": "douxing_screenshot.png"
+}
+
+# ========== 窗口定位配置 ==========
+WINDOW_CONFIG = {
+    "revalidate_interval": 0.5  # 缓存的窗口句柄和位置在该时间内直接使用（秒），超过后再做一次轻量校验
+}
+
+class Win32WindowBackend:
+    """Windows 窗口操作（pywin32）"""
+
+    def find(self, title):
+        return win32gui.FindWindow(None, title) or None
+
+    def is_valid(self, handle):
+        return bool(win32gui.IsWindow(handle))
+
+    def title(self, handle):
+        return win32gui.GetWindowText(handle)
+
+    def rect(self, handle):
+        return tuple(win32gui.GetWindowRect(handle))
+
+    def foreground(self):
+        return win32gui.GetForegroundWindow()
+
+    def set_foreground(self, handle):
+        win32gui.SetForegroundWindow(handle)
+
+    def list_titles(self):
+        titles = []
+        def callback(hwnd, extra):
+            if win32gui.IsWindowVisible(hwnd):
+                title = win32gui.GetWindowText(hwnd)
+                if title:
+                    titles.append(title)
+            return True
+        win32gui.EnumWindows(callback, None)
+        return titles
+
+class FakeWindowBackend:
+    """内存中的窗口表，非Windows平台和测试时使用；calls 记录各操作的调用次数"""
+
+    def __init__(self, windows=None):
+        self.windows = {}          # 句柄 → {"title", "rect"}
+        self.next_handle = 1
+        self.foreground_handle = None
+        self.calls = {}
+        for title, rect in (windows or {}).items():
+            self.create(title, rect)
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def create(self, title, rect):
+        handle = self.next_handle
+        self.next_handle += 1
+        self.windows[handle] = {"title": title, "rect": tuple(rect)}
+        return handle
+
+    def destroy(self, handle):
+        self.windows.pop(handle, None)
+        if self.foreground_handle == handle:
+            self.foreground_handle = None
+
+    def move(self, handle, rect):
+        self.windows[handle]["rect"] = tuple(rect)
+
+    def find(self, title):
+        self._call("find")
+        for handle, window in self.windows.items():
+            if window["title"] == title:
+                return handle
+        return None
+
+    def is_valid(self, handle):
+        self._call("is_valid")
+        return handle in self.windows
+
+    def title(self, handle):
+        self._call("title")
+        return self.windows[handle]["title"] if handle in self.windows else ""
+
+    def rect(self, handle):
+        self._call("rect")
+        return self.windows[handle]["rect"]
+
+    def foreground(self):
+        self._call("foreground")
+        return self.foreground_handle
+
+    def set_foreground(self, handle):
+        self._call("set_foreground")
+        self.foreground_handle = handle
+
+    def list_titles(self):
+        self._call("list_titles")
+        return [window["title"] for window in self.windows.values()]
+
+def create_window_backend():
+    return Win32WindowBackend() if sys.platform == "win32" else FakeWindowBackend()
+
+class WindowLocator:
+    """窗口定位服务：缓存每个标题对应的句柄和位置，间隔内直接返回缓存；
+    超过间隔只校验句柄是否仍有效并读取位置，窗口被关闭重开时才重新按标题查找"""
+
+    def __init__(self, backend, revalidate_interval=0.5):
+        self.backend = backend
+        self.revalidate_interval = revalidate_interval
+        self.cache = {}  # 标题 → [句柄, 位置, 校验时间]
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "revalidations": 0, "lookups": 0, "moves": 0,
+                      "focus_switches": 0, "focus_skipped": 0}
+
+    def locate(self, title):
+        """返回 (句柄, (左,上,右,下))，找不到窗口时返回 (None, None)"""
+        now = time.perf_counter()
+        with self.lock:
+            entry = self.cache.get(title)
+            if entry is not None and now - entry[2] < self.revalidate_interval:
+                self.stats["hits"] += 1
+                return entry[0], entry[1]
+            
+            if entry is not None and self.backend.is_valid(entry[0]) and self.backend.title(entry[0]) == title:
+                self.stats["revalidations"] += 1
+                rect = self.backend.rect(entry[0])
+                if rect != entry[1]:
+                    self.stats["moves"] += 1
+                entry[1], entry[2] = rect, now
+                return entry[0], rect
+            
+            # 首次查找或窗口已被重新创建
+            self.stats["lookups"] += 1
+            handle = self.backend.find(title)
+            if not handle:
+                self.cache.pop(title, None)
+                return None, None
+            rect = self.backend.rect(handle)
+            self.cache[title] = [handle, rect, now]
+            return handle, rect
+
+    def activate(self, title):
+        """把窗口切到前台；已在前台时跳过，返回窗口句柄"""
+        handle, _ = self.locate(title)
+        if handle is None:
+            return None
+        if self.backend.foreground() == handle:
+            self.stats["focus_skipped"] += 1
+        else:
+            self.backend.set_foreground(handle)
+            self.stats["focus_switches"] += 1
+        return handle
+
+    def invalidate(self, title=None):
+        with self.lock:
+            if title is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(title, None)
+
+    def list_titles(self):
+        return self.backend.list_titles()
+
+class ScreenCaptureBackend:
+    """屏幕截图后端：截取绑定的游戏窗口，找不到窗口时截取全屏"""
+
+    def __init__(self, locator=None):
+        self.locator = locator or WindowLocator(create_window_backend(), WINDOW_CONFIG["revalidate_interval"])
+
+    def capture(self, window_title=None):
+        """返回 (PIL图像, 窗口左上角屏幕坐标)"""
+        if window_title:
+            handle, rect = self.locator.locate(window_title)
+            if handle:
+                self.locator.activate(window_title)
+                left, top, right, bottom = rect
+                screenshot = pyautogui.screenshot(region=(left, top, right-left, bottom-top))
+                return screenshot, (left, top)
+            print(f"❌ 未找到窗口：{window_title}，截取全屏")
+        return pyautogui.screenshot(), (0, 0)
+
+    def focus(self, window_title):
+        """点击前把窗口切到前台"""
+        if window_title:
+            self.locator.activate(window_title)
+
+class ReplayCaptureBackend:
+    """回放截图后端：依次返回图片文件中的帧，解码结果缓存在内存中"""
+
+    IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, source, loop=True):
+        if isinstance(source, (list, tuple)):
+            self.files = list(source)
+        elif source and os.path.isdir(source):
+            self.files = sorted(
+                os.path.join(source, name) for name in os.listdir(source)
+                if name.lower().endswith(self.IMAGE_EXTS)
+            )
+        elif source:
+            self.files = [source]
+        else:
+            self.files = []
+        self.loop = loop
+        self.position = 0
+        self.cache = {}
+
+    def capture(self, window_title=None):
+        if not self.files:
+            raise RuntimeError("回放源中没有图片")
+        if self.position >= len(self.files):
+            if not self.loop:
+                raise StopIteration("回放结束")
+            self.position = 0
+        path = self.files[self.position]
+        self.position += 1
+        if path not in self.cache:
+            from PIL import Image
+            with Image.open(path) as img:
+                self.cache[path] = img.convert("RGB")
+        return self.cache[path], (0, 0)
+
+    def focus(self, window_title):
+        pass
+
+def create_capture_backend(config, locator=None):
+    if config.get("backend") == "replay":
+        return ReplayCaptureBackend(config.get("replay_source"), config.get("replay_loop", True))
+    return ScreenCaptureBackend(locator)
+
+# ========== 连续答题配置 ==========
+CONTINUOUS_CONFIG = {
+    "fps": 4,               # 每秒采样帧数
+    "hash_threshold": 6,    # 感知哈希的汉明距离超过该值才视为题目区域发生变化
+    "stable_frames": 1,     # 变化后需连续稳定的帧数，避免在切换动画中途识别
+    "max_duration": None,   # 最长运行时间（秒），为空时一直运行直到 Ctrl+C
+    "auto_learn": False     # 遇到新题是否进入10秒自动学习（连续模式下默认跳过）
+}
+
+def frame_hash(image):
+    """差值哈希（dHash）：缩放到9x8灰度图，比较相邻像素得到64位指纹"""
+    small = image.convert('L').resize((9, 8))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
+
+# ========== OCR引擎配置 ==========
+OCR_CONFIG = {
+    "lang": "chi_sim",
+    "engine": "auto",       # auto：优先tesserocr常驻模型，不可用时退回pytesseract；也可指定 tesserocr / pytesseract
+    "workers": 2,           # 常驻OCR工作线程数（每个线程持有一份已加载的模型）
+    "tessdata_path": None   # tessdata目录，为空时根据tesseract_cmd推断
+}
+
+class OCREngine:
+    """OCR引擎层：工作线程常驻并复用已加载的识别模型，支持批量识别多张图像/区域"""
+
+    def __init__(self, lang="chi_sim", engine="auto", workers=2, tessdata_path=None):
+        self.lang = lang
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.tessdata_path = tessdata_path
+        self.backend = None
+        self.executor = None
+        self.local = threading.local()
+        self.apis = []
+        self.lock = threading.Lock()
+
+    def _resolve_backend(self):
+        if self.backend is not None:
+            return self.backend
+        self.backend = "pytesseract"
+        if self.engine in ("auto", "tesserocr"):
+            try:
+                import tesserocr
+                self.backend = "tesserocr"
+            except ImportError:
+                if self.engine == "tesserocr":
+                    print("⚠️ 未安装tesserocr，OCR退回pytesseract（每次调用启动一个tesseract进程）")
+        if self.backend == "tesserocr" and not self.tessdata_path:
+            tessdata = os.path.join(os.path.dirname(pytesseract.pytesseract.tesseract_cmd), "tessdata")
+            if os.path.isdir(tessdata):
+                self.tessdata_path = tessdata
+        return self.backend
+
+    def _api(self):
+        """每个工作线程只加载一次模型，之后一直复用"""
+        api = getattr(self.local, "api", None)
+        if api is None:
+            from tesserocr import PyTessBaseAPI
+            if self.tessdata_path:
+                api = PyTessBaseAPI(path=self.tessdata_path, lang=self.lang)
+            else:
+                api = PyTessBaseAPI(lang=self.lang)
+            self.local.api = api
+            with self.lock:
+                self.apis.append(api)
+        return api
+
+    def _recognize_one(self, image):
+        with metrics.span("ocr"):
+            if self._resolve_backend() == "tesserocr":
+                api = self._api()
+                api.SetImage(image)
+                return api.GetUTF8Text()
+            return pytesseract.image_to_string(image, lang=self.lang)
+
+    def _data_one(self, image):
+        """逐词识别并返回位置：[{text, left, top, right, bottom, conf, line}]"""
+        words = []
+        if self._resolve_backend() == "tesserocr":
+            from tesserocr import RIL, iterate_level
+            api = self._api()
+            api.SetImage(image)
+            api.Recognize()
+            line = -1
+            for item in iterate_level(api.GetIterator(), RIL.WORD):
+                if item.IsAtBeginningOf(RIL.TEXTLINE):
+                    line += 1
+                text = item.GetUTF8Text(RIL.WORD)
+                box = item.BoundingBox(RIL.WORD)
+                if text and box:
+                    words.append({"text": text, "left": box[0], "top": box[1], "right": box[2],
+                                  "bottom": box[3], "conf": item.Confidence(RIL.WORD), "line": max(line, 0)})
+            return words
+        data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+        for i, text in enumerate(data["text"]):
+            if not text.strip():
+                continue
+            left, top = data["left"][i], data["top"][i]
+            words.append({"text": text, "left": left, "top": top,
+                          "right": left + data["width"][i], "bottom": top + data["height"][i],
+                          "conf": float(data["conf"][i]),
+                          "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i])})
+        return words
+
+    def _pool(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="douxing-ocr")
+        return self.executor
+
+    def recognize(self, image):
+        return self._pool().submit(self._recognize_one, image).result()
+
+    def recognize_batch(self, images):
+        """一次提交多张图像，由常驻工作线程并行识别，结果顺序与输入一致"""
+        return list(self._pool().map(self._recognize_one, images))
+
+    def recognize_data(self, image):
+        return self._pool().submit(self._timed_data_one, image).result()
+
+    def _timed_data_one(self, image):
+        with metrics.span("ocr"):
+            return self._data_one(image)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        with self.lock:
+            for api in self.apis:
+                api.End()
+            self.apis = []
+
+# ========== OCR前图像预处理配置 ==========
+PREPROCESS_CONFIG = {
+    "default_steps": [],        # 游戏配置未指定 preprocess 时使用的步骤，为空即只做灰度化（原有行为）
+    "target_glyph_height": 32,  # rescale：把文字高度缩放到tesseract识别效果最好的像素高度
+    "threshold_block_size": 31, # adaptive_threshold：邻域大小（奇数）
+    "threshold_c": 10,          # adaptive_threshold：从邻域均值中减去的常数
+    "deskew_max_angle": 5.0     # deskew：搜索的最大倾斜角度（度）
+}
+PREPROCESS_STEPS = ("rescale", "denoise", "adaptive_threshold", "deskew")
+
+def estimate_glyph_height(pixels):
+    """按行投影估计文字高度：二值化后统计连续有墨迹的行数，取中位数"""
+    import numpy as np
+    _, binary = cv2.threshold(pixels, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # 墨迹按少数像素一侧计算，兼容深底浅字和浅底深字
+    ink = binary == 0 if (binary == 0).mean() < 0.5 else binary == 255
+    rows = ink.sum(axis=1) > max(1, pixels.shape[1] // 200)
+    runs, length = [], 0
+    for has_ink in rows:
+        if has_ink:
+            length += 1
+        elif length:
+            runs.append(length)
+            length = 0
+    if length:
+        runs.append(length)
+    runs = [r for r in runs if r >= 4]
+    return int(np.median(runs)) if runs else 0
+
+def deskew_angle(binary, max_angle=5.0, step=0.5):
+    """在 ±max_angle 范围内搜索使行投影方差最大的旋转角度"""
+    import numpy as np
+    height, width = binary.shape
+    center = (width / 2, height / 2)
+    ink = (255 - binary) if (binary == 0).mean() < 0.5 else binary
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        matrix = cv2.getRotationMatrix2D(center, float(angle), 1.0)
+        rotated = cv2.warpAffine(ink, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=0)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def preprocess_image(gray, steps, config=None):
+    """按 steps 顺序对灰度图做 缩放/降噪/自适应二值化/纠偏，返回 (处理后的PIL图像, 坐标变换)；
+    坐标变换是把原图坐标映射到处理后图像坐标的 3x3 矩阵，没有缩放和旋转时为 None"""
+    if not steps:
+        return gray, None
+    import numpy as np
+    from PIL import Image
+    config = config or PREPROCESS_CONFIG
+    pixels = np.asarray(gray)
+    transform = np.eye(3)
+    for step in steps:
+        if step == "rescale":
+            glyph = estimate_glyph_height(pixels)
+            if glyph:
+                factor = min(4.0, max(0.25, config["target_glyph_height"] / glyph))
+                if abs(factor - 1.0) > 0.1:
+                    size = (max(1, int(pixels.shape[1] * factor)), max(1, int(pixels.shape[0] * factor)))
+                    pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_CUBIC if factor > 1 else cv2.INTER_AREA)
+                    transform = np.diag([factor, factor, 1.0]) @ transform
+        elif step == "denoise":
+            pixels = cv2.medianBlur(pixels, 3)
+        elif step == "adaptive_threshold":
+            pixels = cv2.adaptiveThreshold(
+                pixels, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                config["threshold_block_size"], config["threshold_c"]
+            )
+        elif step == "deskew":
+            angle = deskew_angle(pixels, config["deskew_max_angle"])
+            if angle:
+                height, width = pixels.shape
+                matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+                pixels = cv2.warpAffine(pixels, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                                        borderMode=cv2.BORDER_REPLICATE)
+                transform = np.vstack([matrix, [0.0, 0.0, 1.0]]) @ transform
+    if np.allclose(transform, np.eye(3)):
+        transform = None
+    return Image.fromarray(pixels), transform
+
+def unmap_box(transform, box):
+    """把处理后图像中的 (左,上,右,下) 映射回原图坐标：四个角做逆变换后取外接矩形"""
+    import numpy as np
+    left, top, right, bottom = box
+    corners = np.array([[left, top, 1.0], [right, top, 1.0], [left, bottom, 1.0], [right, bottom, 1.0]])
+    points = corners @ np.linalg.inv(transform).T
+    return (int(points[:, 0].min()), int(points[:, 1].min()),
+            int(round(points[:, 0].max())), int(round(points[:, 1].max())))
+
+# ========== OCR结果缓存配置 ==========
+OCR_CACHE_CONFIG = {
+    "enabled": True,
+    "max_entries": 2048,            # 最多缓存的识别结果条数
+    "max_bytes": 4 * 1024 * 1024,   # 缓存占用内存上限（字节，按键和文字估算）
+    "hash_size": 16,                # 感知哈希边长，16 即 256 位指纹，越大越不容易把不同题目判为相同
+    "persist": False,               # 是否跨重启保存缓存
+    "cache_file": "ocr_cache.json"
+}
+
+def perceptual_hash(image, hash_size=16):
+    """DCT感知哈希：缩放后取低频系数与中位数比较，对轻微噪点和压缩不敏感"""
+    import numpy as np
+    side = hash_size * 4
+    pixels = np.asarray(image.convert('L').resize((side, side)), dtype=np.float32)
+    low = cv2.dct(pixels)[:hash_size, :hash_size]
+    bits = (low > np.median(low)).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+class OCRCache:
+    """以感知哈希为键的OCR结果缓存，按条数和内存双重上限做LRU淘汰"""
+
+    def __init__(self, max_entries=2048, max_bytes=4 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _size(key, text):
+        return sys.getsizeof(key) + sys.getsizeof(text)
+
+    def get(self, key):
+        with self.lock:
+            text = self.entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self._size(key, self.entries.pop(key))
+            self.entries[key] = text
+            self.bytes += self._size(key, text)
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                old_key, old_text = self.entries.popitem(last=False)
+                self.bytes -= self._size(old_key, old_text)
+                self.evictions += 1
+
+    def snapshot(self):
+        """按从旧到新的顺序导出，便于持久化后按原LRU顺序恢复"""
+        with self.lock:
+            return [[key, text] for key, text in self.entries.items()]
+
+    def load(self, items):
+        for key, text in items:
+            self.put(key, text)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+# ========== 题库多模式匹配索引 ==========
+class QuestionIndex:
+    """Aho-Corasick 自动机：一次扫描OCR文本即可找出题库中最长的匹配题目"""
+
+    def __init__(self, keys=()):
+        self.goto = [{}]     # 每个节点的字符转移表
+        self.fail = [0]      # 失败指针
+        self.key = [None]    # 以该节点结尾的题目
+        self.best = [None]   # 该节点（含失败链）能匹配到的最长题目
+        self.size = 0
+        self._dirty = False
+        self.learned = None  # 运行中学到的新题放在小自动机里，重建索引时再并入
+        self.lock = threading.RLock()  # 多窗口答题时多个线程共用一个索引
+        for k in keys:
+            self._insert(k)
+        self.build()
+
+    def __len__(self):
+        return self.size + (len(self.learned) if self.learned is not None else 0)
+
+    def _insert(self, key):
+        """把题目插入字典树，失败指针推迟到下次查询前统一重建"""
+        node = 0
+        for ch in key:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                # 先把新节点的各列表补齐，再挂到父节点上
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.key.append(None)
+                self.best.append(None)
+                self.goto[node][ch] = nxt
+            node = nxt
+        if self.key[node] is None:
+            self.size += 1
+            self.key[node] = key
+            self._dirty = True
+
+    def _contains(self, key):
+        node = 0
+        for ch in key:
+            node = self.goto[node].get(ch)
+            if node is None:
+                return False
+        return self.key[node] is not None
+
+    def add(self, key):
+        """加入一道新学到的题目
+
+        只插入小自动机并在其上重建失败指针，大自动机保持不变，
+        题库再次加载或整理时由 rebuild_question_index 一并重建
+        """
+        if not key:
+            return
+        with self.lock:
+            if self._contains(key):
+                return
+            if self.learned is None:
+                self.learned = QuestionIndex()
+            self.learned._insert(key)
+
+    def build(self):
+        """按BFS顺序计算失败指针和最长输出"""
+        queue = []
+        for nxt in self.goto[0].values():
+            self.fail[nxt] = 0
+            self.best[nxt] = self.key[nxt]
+            queue.append(nxt)
+        i = 0
+        while i < len(queue):
+            node = queue[i]
+            i += 1
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                # 自身题目一定比失败链上的后缀题目更长
+                self.best[nxt] = self.key[nxt] or self.best[self.fail[nxt]]
+                queue.append(nxt)
+        self._dirty = False
+
+    def _scan(self, text):
+        if self._dirty:
+            self.build()
+        goto, fail, best = self.goto, self.fail, self.best
+        node = 0
+        found = None
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = best[node]
+            if hit is not None and (found is None or len(hit) > len(found)):
+                found = hit
+        return found
+
+    def longest_match(self, text):
+        """返回文本中出现的最长题目（同长度取最先出现的），没有则返回None
+
+        读取也持锁：多窗口答题时主线程学习新题会修改小自动机，不能边改边读
+        """
+        with self.lock:
+            found = self._scan(text)
+            if self.learned is not None:
+                hit = self.learned._scan(text)
+                if hit is not None and (found is None or len(hit) > len(found)):
+                    found = hit
+            return found
+
+class FuzzyQuestionIndex:
+    """字符二元/三元组倒排索引：OCR错一两个字时仍能召回最相近的题目"""
+
+    def __init__(self, keys=(), max_postings=2000):
+        self.keys = []
+        self.key_grams = []
+        self.ids = {}
+        self.postings = {}
+        self.max_postings = max_postings
+        for k in keys:
+            self.add(k)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def grams(text):
+        """提取文本的二元组和三元组，单字文本直接作为一个字组"""
+        if len(text) < 2:
+            return {text} if text else set()
+        result = {text[i:i + 2] for i in range(len(text) - 1)}
+        result.update(text[i:i + 3] for i in range(len(text) - 2))
+        return result
+
+    def add(self, key):
+        if not key or key in self.ids:
+            return
+        key_id = len(self.keys)
+        grams = self.grams(key)
+        self.ids[key] = key_id
+        self.keys.append(key)
+        self.key_grams.append(grams)
+        for g in grams:
+            self.postings.setdefault(g, []).append(key_id)
+
+    def search(self, text, top_k=3, threshold=0.0):
+        """返回 [(题目, 相似度)]，相似度 = 1 - 错字数 / 题目长度，错字数按题目与文本中最相近一段的编辑距离计算"""
+        query = self.grams(text)
+        if not query:
+            return []
+        # 召回：只用低频字组累计命中次数
+        hits = {}
+        for g in query:
+            posting = self.postings.get(g)
+            if posting is None or len(posting) > self.max_postings:
+                continue
+            for key_id in posting:
+                hits[key_id] = hits.get(key_id, 0) + 1
+        return self.rank(hits, text, query, self.keys.__getitem__, self.key_grams.__getitem__, top_k, threshold)
+
+    @classmethod
+    def rank(cls, hits, text, query, key_of, grams_of, top_k, threshold):
+        """精排：对命中字组最多的候选计算完整相似度；key_of/grams_of 按题目下标取题目文本和字组"""
+        if not hits:
+            return []
+        shortlist = sorted(hits, key=hits.get, reverse=True)[:max(top_k * 10, 20)]
+        scored = []
+        for key_id in shortlist:
+            key = key_of(key_id)
+            score = cls.similarity(key, grams_of(key_id), text, query)
+            if score > 0 and score >= threshold:
+                scored.append((key, score))
+        scored.sort(key=lambda item: (-item[1], -len(item[0])))
+        return scored[:top_k]
+
+    @classmethod
+    def similarity(cls, key, grams, text, query, config=MATCH_CONFIG):
+        """题目与文本中最相近一段的相似度 1 - 错字数/题目长度；题目过短、错字超出按长度给的预算时返回0"""
+        if len(key) < config["fuzzy_min_key_length"]:
+            return 0.0
+        budget = int(len(key) * config["fuzzy_error_rate"])
+        bigrams = {g for g in grams if len(g) == 2}
+        matched = len(bigrams & query)
+        # 一个错字最多破坏两个二元组：缺的二元组超过 2×预算的候选不必再做对齐
+        if matched < config["fuzzy_min_bigrams"] or len(bigrams) - matched > 2 * budget:
+            return 0.0
+        errors = cls.window_errors(key, text, budget)
+        if errors > budget:
+            return 0.0
+        return 1.0 - errors / len(key)
+
+    @staticmethod
+    def window_errors(key, text, budget):
+        """key 与 text 任意一段之间的最小编辑距离（近似子串匹配，起止位置不计代价）；
+        超过 budget 时提前返回 budget + 1"""
+        prev = [0] * (len(text) + 1)
+        for i, kc in enumerate(key, 1):
+            cur = [i]
+            for j, tc in enumerate(text, 1):
+                cur.append(min(prev[j - 1] + (kc != tc), prev[j] + 1, cur[j - 1] + 1))
+            if min(cur) > budget:
+                return budget + 1
+            prev = cur
+        return min(prev)
+
+# ========== 编译题库配置 ==========
+BANK_CONFIG = {
+    "format": "json",  # json：整个题库读入内存；compiled：编译成排序的二进制文件，用mmap按需查找，多个进程共享页缓存
+    "compiled_name": "game_question_bank",           # 编译文件名前缀，实际文件为 <前缀>.<代数>.dxqb
+    "overlay_file": "game_question_bank.overlay.json", # 编译后新学到的题目，整理题库时并入编译文件
+    "overlay_warn_size": 5000  # 新增题目超过该数量时启动提示整理题库
+}
+
+class CompiledQuestionBank:
+    """只读的编译题库：题目按UTF-8字节序排列，答案字符串去重后存入字符串区，通过mmap按需读取。
+    文件布局：文件头 | 题目表(题目偏移,长度,答案起始,答案数) | 答案引用表 | 字符串表(偏移,长度)
+    | 字组表(字组偏移,长度,倒排起始,倒排数) | 倒排表(题目下标) | 数据区
+    字组表是容错匹配用的二元/三元组倒排索引，按字节序排列，查询时二分查找，不需要整体读入内存"""
+
+    MAGIC = b"DXQB0002"
+    LEGACY_MAGIC = b"DXQB0001"         # 旧版文件没有字组表，加载时重新编译
+    HEADER = struct.Struct("<8sIIIII")  # 魔数、题目数、答案引用数、字符串数、字组数、倒排数
+    LEGACY_HEADER = struct.Struct("<8sIII")
+    ENTRY = struct.Struct("<IIII")
+    REF = struct.Struct("<I")
+    STRING = struct.Struct("<II")
+    GRAM = struct.Struct("<IIII")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.mm[:8]
+        if magic == self.MAGIC:
+            _, self.count, ref_count, string_count, self.gram_count, posting_count = self.HEADER.unpack_from(self.mm, 0)
+            header_size = self.HEADER.size
+        elif magic == self.LEGACY_MAGIC:
+            _, self.count, ref_count, string_count = self.LEGACY_HEADER.unpack_from(self.mm, 0)
+            self.gram_count = posting_count = 0
+            header_size = self.LEGACY_HEADER.size
+        else:
+            self.close()
+            raise ValueError(f"不是有效的编译题库文件：{path}")
+        self.legacy = magic == self.LEGACY_MAGIC
+        self.entries_offset = header_size
+        self.refs_offset = self.entries_offset + self.count * self.ENTRY.size
+        self.strings_offset = self.refs_offset + ref_count * self.REF.size
+        self.grams_offset = self.strings_offset + string_count * self.STRING.size
+        self.postings_offset = self.grams_offset + self.gram_count * self.GRAM.size
+        self.blob_offset = self.postings_offset + posting_count * self.REF.size
+
+    @classmethod
+    def compile(cls, path, items):
+        """把 (题目, 答案列表) 写成编译题库，先写临时文件再原子替换"""
+        entries = sorted((key.encode("utf-8"), answers) for key, answers in items)
+        strings, string_ids, refs = [], {}, []
+        blob = bytearray()
+        table = []
+        for key_bytes, answers in entries:
+            key_offset = len(blob)
+            blob += key_bytes
+            ref_start = len(refs)
+            for answer in answers:
+                string_id = string_ids.get(answer)
+                if string_id is None:
+                    data = answer.encode("utf-8")
+                    string_id = string_ids[answer] = len(strings)
+                    strings.append((len(blob), len(data)))
+                    blob += data
+                refs.append(string_id)
+            table.append((key_offset, len(key_bytes), ref_start, len(answers)))
+        
+        # 容错匹配的倒排索引：字组 → 含该字组的题目下标（升序）
+        postings = {}
+        for key_id, (key_bytes, _) in enumerate(entries):
+            for gram in FuzzyQuestionIndex.grams(key_bytes.decode("utf-8")):
+                postings.setdefault(gram.encode("utf-8"), []).append(key_id)
+        grams, posting_refs = [], []
+        for gram_bytes in sorted(postings):
+            ids = postings[gram_bytes]
+            grams.append((len(blob), len(gram_bytes), len(posting_refs), len(ids)))
+            blob += gram_bytes
+            posting_refs.extend(ids)
+        
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(table), len(refs), len(strings), len(grams), len(posting_refs)))
+            f.write(b"".join(cls.ENTRY.pack(*entry) for entry in table))
+            f.write(b"".join(cls.REF.pack(ref) for ref in refs))
+            f.write(b"".join(cls.STRING.pack(*item) for item in strings))
+            f.write(b"".join(cls.GRAM.pack(*item) for item in grams))
+            f.write(struct.pack(f"<{len(posting_refs)}I", *posting_refs))
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(table)
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, index):
+        return self.ENTRY.unpack_from(self.mm, self.entries_offset + index * self.ENTRY.size)
+
+    def _key_bytes(self, index):
+        key_offset, key_len, _, _ = self._entry(index)
+        start = self.blob_offset + key_offset
+        return self.mm[start:start + key_len]
+
+    def _bisect_right(self, target):
+        """最后一个 <= target 的题目下标 + 1"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if target < self._key_bytes(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def find(self, key):
+        """二分查找题目，返回下标或 None"""
+        key_bytes = key.encode("utf-8")
+        index = self._bisect_right(key_bytes) - 1
+        if index >= 0 and self._key_bytes(index) == key_bytes:
+            return index
+        return None
+
+    def key(self, index):
+        return self._key_bytes(index).decode("utf-8")
+
+    def answers(self, index):
+        _, _, ref_start, ref_count = self._entry(index)
+        result = []
+        for i in range(ref_start, ref_start + ref_count):
+            (string_id,) = self.REF.unpack_from(self.mm, self.refs_offset + i * self.REF.size)
+            offset, length = self.STRING.unpack_from(self.mm, self.strings_offset + string_id * self.STRING.size)
+            start = self.blob_offset + offset
+            result.append(self.mm[start:start + length].decode("utf-8"))
+        return result
+
+    def get(self, key, default=None):
+        index = self.find(key)
+        return default if index is None else self.answers(index)
+
+    def keys(self):
+        for index in range(self.count):
+            yield self.key(index)
+
+    def items(self):
+        for index in range(self.count):
+            yield self.key(index), self.answers(index)
+
+    def _find_gram(self, gram_bytes):
+        """二分查找字组，返回 (倒排起始, 倒排数) 或 None"""
+        lo, hi = 0, self.gram_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, start, count = self.GRAM.unpack_from(self.mm, self.grams_offset + mid * self.GRAM.size)
+            data = self.mm[self.blob_offset + offset:self.blob_offset + offset + length]
+            if data == gram_bytes:
+                return start, count
+            if data < gram_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def fuzzy_search(self, text, top_k=3, threshold=0.0, max_postings=2000):
+        """与 FuzzyQuestionIndex.search 相同的容错匹配，倒排表直接从文件读取"""
+        query = FuzzyQuestionIndex.grams(text)
+        hits = {}
+        for gram in query:
+            located = self._find_gram(gram.encode("utf-8"))
+            if located is None or located[1] > max_postings:
+                continue
+            start, count = located
+            for key_id in struct.unpack_from(f"<{count}I", self.mm, self.postings_offset + start * self.REF.size):
+                hits[key_id] = hits.get(key_id, 0) + 1
+        grams_of = lambda key_id: FuzzyQuestionIndex.grams(self.key(key_id))
+        return FuzzyQuestionIndex.rank(hits, text, query, self.key, grams_of, top_k, threshold)
+
+    def longest_prefix(self, data):
+        """data 的前缀中最长的题目（bytes），没有则返回 None。
+        不大于 data 的最大题目若不是前缀，更长的前缀题目也不可能存在，只需在公共前缀内继续找"""
+        while data:
+            index = self._bisect_right(data) - 1
+            if index < 0:
+                return None
+            key_bytes = self._key_bytes(index)
+            if data.startswith(key_bytes):
+                return key_bytes
+            common = 0
+            limit = min(len(key_bytes), len(data))
+            while common < limit and key_bytes[common] == data[common]:
+                common += 1
+            data = data[:common]
+        return None
+
+    def longest_match(self, text):
+        """与 QuestionIndex.longest_match 相同：文本中出现的最长题目（同长度取最先出现的）"""
+        # 同一起点的前缀题目按字节比较即可；不同起点之间必须按字符数比较，中文一个字占3字节
+        data = text.encode("utf-8")
+        found = None
+        offset = 0
+        for i, ch in enumerate(text):
+            if found is not None and len(text) - i <= len(found):
+                break
+            hit = self.longest_prefix(data[offset:])
+            if hit is not None:
+                hit = hit.decode("utf-8")
+                if found is None or len(hit) > len(found):
+                    found = hit
+            offset += len(ch.encode("utf-8"))
+        return found
+
+class LayeredQuestionBank:
+    """编译题库 + 新增题目覆盖层，对外表现为题目 → 答案列表的字典"""
+
+    def __init__(self, base, overlay):
+        self.base = base
+        self.overlay = overlay
+        self.extra = sum(1 for key in overlay if base.find(key) is None)
+
+    def __len__(self):
+        return len(self.base) + self.extra
+
+    def __contains__(self, key):
+        return key in self.overlay or self.base.find(key) is not None
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            return self.overlay[key]
+        answers = self.base.get(key)
+        if answers is None:
+            raise KeyError(key)
+        return answers
+
+    def __setitem__(self, key, answers):
+        if key not in self.overlay and self.base.find(key) is None:
+            self.extra += 1
+        self.overlay[key] = answers
+
+    def __iter__(self):
+        return self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        for key, _ in self.items():
+            yield key
+
+    def items(self):
+        for key, answers in self.base.items():
+            yield key, self.overlay.get(key, answers)
+        for key, answers in list(self.overlay.items()):
+            if self.base.find(key) is None:
+                yield key, answers
+
+    def overlay_snapshot(self):
+        return dict(self.overlay)
+
+    def merge_overlay(self, other):
+        """并入其他进程写入的新增题目（同一题目合并答案），返回本进程原来没有的题目"""
+        added = []
+        for key, answers in other.items():
+            mine = self.overlay.get(key)
+            if mine is None:
+                self[key] = list(answers)
+                added.append(key)
+                continue
+            extra = [a for a in answers if a not in mine]
+            if extra:
+                self.overlay[key] = mine + extra
+        return added
+
+class LayeredQuestionIndex:
+    """编译题库用二分查找匹配，覆盖层仍用 Aho-Corasick 自动机"""
+
+    def __init__(self, base, overlay_keys=()):
+        self.base = base
+        self.overlay_index = QuestionIndex(overlay_keys)
+
+    def __len__(self):
+        return len(self.base) + len(self.overlay_index)
+
+    def add(self, key):
+        self.overlay_index.add(key)
+
+    def longest_match(self, text):
+        found = self.base.longest_match(text)
+        hit = self.overlay_index.longest_match(text)
+        if hit is not None and (found is None or len(hit) > len(found)):
+            found = hit
+        return found
+
+# ========== 答案按钮模板匹配配置 ==========
+TEMPLATE_CONFIG = {
+    "template_dir": "answer_templates",   # 模板目录：<答案>.png，或 <答案>/ 子目录下放多张图
+    "scales": [0.8, 0.9, 1.0, 1.1, 1.25], # 模板金字塔的缩放比例
+    "threshold": 0.8,                      # 匹配置信度下限
+    "scale_step": 0.05,                    # 窗口缩放比例按该步长取整，避免每个窗口尺寸都生成一套模板
+    "pyramid_cache_size": 256              # 最多缓存的缩放后模板数（LRU）
+}
+
+class TemplateMatcher:
+    """答案按钮模板匹配：预加载灰度模板并缓存各缩放层，只在选项区域内搜索"""
+
+    IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, template_dir, scales=(1.0,), threshold=0.8, scale_step=0.05, cache_size=256):
+        self.template_dir = template_dir
+        self.scales = list(scales)
+        self.threshold = threshold
+        self.scale_step = scale_step
+        self.cache_size = cache_size
+        self.templates = {}             # 答案 -> [灰度模板]
+        self.pyramid = OrderedDict()    # (答案, 模板序号, 缩放比例) -> 缩放后的模板，LRU
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def load(self):
+        self.templates = {}
+        self.pyramid = OrderedDict()
+        self.loaded = True
+        if not os.path.isdir(self.template_dir):
+            return 0
+        import numpy as np
+        for name in sorted(os.listdir(self.template_dir)):
+            path = os.path.join(self.template_dir, name)
+            if os.path.isdir(path):
+                answer = name
+                files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(self.IMAGE_EXTS)]
+            elif name.lower().endswith(self.IMAGE_EXTS):
+                answer = os.path.splitext(name)[0]
+                files = [path]
+            else:
+                continue
+            for file in files:
+                # cv2.imread 不支持中文路径，先读字节再解码
+                template = cv2.imdecode(np.fromfile(file, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+                if template is not None:
+                    self.templates.setdefault(answer, []).append(template)
+        return sum(len(t) for t in self.templates.values())
+
+    def has(self, answer):
+        if not self.loaded:
+            self.load()
+        return answer in self.templates
+
+    def _scaled(self, answer, index, scale):
+        key = (answer, index, round(scale, 3))
+        with self.lock:
+            template = self.pyramid.get(key)
+            if template is not None:
+                self.pyramid.move_to_end(key)
+                return template
+        base = self.templates[answer][index]
+        if key[2] == 1.0:
+            template = base
+        else:
+            size = (max(1, int(base.shape[1] * scale)), max(1, int(base.shape[0] * scale)))
+            template = cv2.resize(base, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        with self.lock:
+            self.pyramid[key] = template
+            while len(self.pyramid) > self.cache_size:
+                self.pyramid.popitem(last=False)
+        return template
+
+    def match(self, search_gray, answers=None, scale_hint=1.0):
+        """在同一张灰度搜索图上为所有候选模板打分，返回按置信度降序的
+        [{answer, score, center, scale}]，center 为搜索图内坐标"""
+        if not self.loaded:
+            self.load()
+        # 窗口尺寸千差万别，缩放比例按步长取整，缓存的模板层数才有上限
+        if self.scale_step:
+            scale_hint = max(self.scale_step, round(scale_hint / self.scale_step) * self.scale_step)
+        results = []
+        height, width = search_gray.shape[:2]
+        for answer in (answers if answers is not None else list(self.templates)):
+            best = None
+            for index in range(len(self.templates.get(answer, []))):
+                for scale in self.scales:
+                    template = self._scaled(answer, index, scale * scale_hint)
+                    th, tw = template.shape[:2]
+                    if th > height or tw > width:
+                        continue
+                    scores = cv2.matchTemplate(search_gray, template, cv2.TM_CCOEFF_NORMED)
+                    _, score, _, (x, y) = cv2.minMaxLoc(scores)
+                    if best is None or score > best["score"]:
+                        best = {"answer": answer, "score": float(score),
+                                "center": (x + tw // 2, y + th // 2), "scale": scale * scale_hint}
+            if best is not None:
+                results.append(best)
+        results.sort(key=lambda r: -r["score"])
+        return results
+
+# ========== 流水线答题配置 ==========
+PIPELINE_CONFIG = {
+    "fps": 10,             # 截图阶段的采样帧率
+    "queue_size": 2,       # 各阶段之间的队列长度，满了就丢弃最旧的帧
+    "max_duration": None   # 最长运行时间（秒），为空时一直运行直到 Ctrl+C
+}
+
+class AnswerPipeline:
+    """截图→预处理→OCR→查题→点击 五个阶段各占一个线程，阶段之间用有界队列连接；
+    OCR跟不上时丢弃过期帧，吞吐量由最慢的阶段决定而不是各阶段耗时之和"""
+
+    STAGES = ("capture", "preprocess", "ocr", "match", "click")
+
+    def __init__(self, bot, fps=10, queue_size=2):
+        self.bot = bot
+        self.interval = 1.0 / fps
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in self.STAGES[1:]}
+        self.stop_event = threading.Event()
+        self.latencies = {name: deque(maxlen=1000) for name in self.STAGES + ("total",)}
+        self.dropped = {name: 0 for name in self.STAGES[1:]}
+        self.counts = {name: 0 for name in self.STAGES}
+        self.threads = []
+        self.last_question = None
+        self.sent_hash = None
+        self.prev_hash = None
+
+    def _put(self, name, item, drop_oldest=True):
+        """放入下一阶段的队列；队列已满时丢弃最旧的一项，保证下游处理的总是最新画面"""
+        q = self.queues[name]
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                if not drop_oldest or item is None:
+                    q.put(item)
+                    return
+                try:
+                    if q.get_nowait() is not None:
+                        self.dropped[name] += 1
+                except queue.Empty:
+                    pass
+
+    def _record(self, name, started):
+        self.latencies[name].append(time.perf_counter() - started)
+        self.counts[name] += 1
+
+    def _capture_loop(self):
+        while not self.stop_event.is_set():
+            tick = time.perf_counter()
+            try:
+                frame = self.bot.take_screenshot(verbose=False)
+            except StopIteration:
+                break
+            except Exception as e:
+                print(f"❌ 截图阶段出错：{e}")
+                break
+            self._record("capture", tick)
+            self._put("preprocess", {"frame": frame, "origin": self.bot.last_capture_origin, "captured": tick})
+            remaining = self.interval - (time.perf_counter() - tick)
+            if remaining > 0:
+                self.stop_event.wait(remaining)
+        self._put("preprocess", None)
+
+    def _preprocess(self, item):
+        """题目区域稳定且与上次处理的画面不同才送去OCR"""
+        current = frame_hash(self.bot.question_region(item["frame"]))
+        threshold = CONTINUOUS_CONFIG["hash_threshold"]
+        stable = self.prev_hash is not None and hash_distance(current, self.prev_hash) <= threshold
+        self.prev_hash = current
+        if not stable or (self.sent_hash is not None and hash_distance(current, self.sent_hash) <= threshold):
+            return None
+        self.sent_hash = current
+        item["job"] = self.bot.prepare_layout(item["frame"])
+        return item
+
+    def _ocr(self, item):
+        if item["job"]["layout"] is None:
+            self.bot.ocr_layout(item["job"])
+        item["layout"] = item["job"]["layout"]
+        return item
+
+    def _match(self, item):
+        text = item["layout"]["question"]
+        if not text or text == self.last_question:
+            return None
+        self.last_question = text
+        answer = self.bot.find_correct_answer(text, learn=False)
+        if not answer:
+            return None
+        item["answer"] = answer
+        item["position"] = self.bot.answer_position(item["frame"], item["layout"], answer, item["origin"])
+        return item
+
+    def _click(self, item):
+        clicked = self.bot.human_click(item["answer"], item["position"])
+        cycle = time.perf_counter() - item["captured"]
+        self.latencies["total"].append(cycle)
+        if clicked:
+            metrics.record("answer_cycle", cycle)
+        return None
+
+    def _stage_loop(self, name, func, next_stage, drop_oldest=True):
+        q = self.queues[name]
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            started = time.perf_counter()
+            try:
+                result = func(item)
+            except Exception as e:
+                print(f"❌ {name} 阶段出错：{e}")
+                result = None
+            self._record(name, started)
+            if result is not None and next_stage:
+                self._put(next_stage, result, drop_oldest)
+        if next_stage:
+            self._put(next_stage, None)
+
+    def start(self):
+        stages = [
+            # 只有还没识别的过期帧可以丢弃；OCR之后的题目不再丢弃，保证每道题都会被作答
+            ("preprocess", self._preprocess, "ocr", True),
+            ("ocr", self._ocr, "match", False),
+            ("match", self._match, "click", False),
+            ("click", self._click, None, False),
+        ]
+        self.threads = [threading.Thread(target=self._capture_loop, name="douxing-capture", daemon=True)]
+        for name, func, next_stage, drop in stages:
+            self.threads.append(threading.Thread(
+                target=self._stage_loop, args=(name, func, next_stage, drop), name=f"douxing-{name}", daemon=True
+            ))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def summary(self):
+        result = {}
+        for name, samples in self.latencies.items():
+            ordered = sorted(samples)
+            if ordered:
+                result[name] = {
+                    "count": len(ordered),
+                    "avg_ms": sum(ordered) / len(ordered) * 1000,
+                    "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+                }
+        return result
+
+# ========== 多窗口答题配置 ==========
+MULTI_WINDOW_CONFIG = {
+    "fps": 4,              # 每个窗口每秒采样帧数
+    "max_duration": None,  # 最长运行时间（秒），为空时一直运行直到 Ctrl+C
+    "replay_sources": {}   # 回放后端下 窗口标题 → 图片文件或目录；未配置的窗口使用 CAPTURE_CONFIG 的回放源
+}
+
+class ClickArbiter:
+    """所有窗口共用的点击队列：鼠标同一时刻只能在一处，由一个线程按提交顺序切换窗口并点击"""
+
+    def __init__(self, bot, backend, capture_lock=None):
+        self.bot = bot
+        self.backend = backend
+        self.capture_lock = capture_lock  # 与各窗口截图共用：切前台+点击期间不能有别的窗口截图
+        self.queue = queue.Queue()
+        self.waits = {}   # 窗口 → 排队等待耗时列表
+        self.clicks = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="douxing-click", daemon=True)
+        self.thread.start()
+
+    def submit(self, window_title, answer, position, captured=None):
+        """captured 为该帧的截图时间，点击完成后据此记录整次答题耗时"""
+        self.queue.put((window_title, answer, position, time.perf_counter(), captured))
+
+    def stop(self):
+        self.queue.put(None)
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            window_title, answer, position, submitted, captured = item
+            self.waits.setdefault(window_title, deque(maxlen=1000)).append(time.perf_counter() - submitted)
+            try:
+                if self.capture_lock is None:
+                    clicked = self._click(window_title, answer, position)
+                else:
+                    with self.capture_lock:
+                        clicked = self._click(window_title, answer, position)
+                if clicked:
+                    self.clicks[window_title] = self.clicks.get(window_title, 0) + 1
+                    if captured is not None:
+                        metrics.record("answer_cycle", time.perf_counter() - captured)
+            except Exception as e:
+                print(f"❌ 点击窗口 {window_title} 出错：{e}")
+
+    def _click(self, window_title, answer, position):
+        self.backend.focus(window_title)
+        return self.bot.human_click(answer, position)
+
+class WindowWorker:
+    """单个游戏窗口的答题循环：截图→题目区域变化检测→OCR→查题，点击交给 ClickArbiter"""
+
+    def __init__(self, bot, window_title, backend, arbiter, stop_event, fps=4, capture_lock=None):
+        self.bot = bot
+        self.window_title = window_title
+        self.backend = backend
+        self.arbiter = arbiter
+        self.stop_event = stop_event
+        self.interval = 1.0 / fps
+        self.capture_lock = capture_lock
+        self.stats = {"frames": 0, "ocr": 0, "answered": 0, "unknown": 0, "errors": 0}
+        self.latencies = deque(maxlen=1000)  # 截图到提交点击的耗时
+        self.elapsed = 0.0
+
+    def capture(self):
+        if self.capture_lock is None:
+            return self.backend.capture(self.window_title)
+        # 屏幕截图要先把窗口切到前台，多个窗口必须轮流截
+        with self.capture_lock:
+            return self.backend.capture(self.window_title)
+
+    def run(self):
+        threshold = CONTINUOUS_CONFIG["hash_threshold"]
+        prev_hash = sent_hash = None
+        last_question = None
+        started = time.perf_counter()
+        while not self.stop_event.is_set():
+            tick = time.perf_counter()
+            try:
+                frame, origin = self.capture()
+            except StopIteration:
+                break
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"❌ 窗口 {self.window_title} 截图出错：{e}")
+                break
+            self.stats["frames"] += 1
+            
+            try:
+                # 题目区域稳定且与上次处理的画面不同才识别
+                current = frame_hash(self.bot.question_region(frame))
+                stable = prev_hash is not None and hash_distance(current, prev_hash) <= threshold
+                prev_hash = current
+                if stable and (sent_hash is None or hash_distance(current, sent_hash) > threshold):
+                    sent_hash = current
+                    self.stats["ocr"] += 1
+                    layout = self.bot.read_layout(frame)
+                    text = layout["question"]
+                    if text and text != last_question:
+                        last_question = text
+                        answer = self.bot.find_correct_answer(text, learn=False)
+                        if answer:
+                            position = self.bot.answer_position(frame, layout, answer, origin)
+                            self.arbiter.submit(self.window_title, answer, position, tick)
+                            self.latencies.append(time.perf_counter() - tick)
+                            self.stats["answered"] += 1
+                        else:
+                            self.stats["unknown"] += 1
+            except Exception as e:
+                # 单帧出错只记数，下一帧稳定后重新识别，不让整个窗口线程退出
+                self.stats["errors"] += 1
+                sent_hash = last_question = None
+                print(f"❌ 窗口 {self.window_title} 处理画面出错：{e}")
+            
+            remaining = self.interval - (time.perf_counter() - tick)
+            if remaining > 0:
+                self.stop_event.wait(remaining)
+        self.elapsed = time.perf_counter() - started
+        return self.stats
+
+# 选项前的编号，如 "A."、"B、"、"C："
+OPTION_LABEL_PATTERN = re.compile(r"^[A-Da-d][\.．、:：]")
+
 class DouXingAI:
-    def __init__(self):
+    def __init__(self, fast_start=None):
+        self.startup_started = time.perf_counter()
+        self.startup_timings = []
+        self.phase_clock = threading.local()  # 每个线程各自记录上一阶段的结束时间
+        self.phase_clock.started = self.startup_started
+        self.fast_start = STARTUP_CONFIG["fast_start"] if fast_start is None else fast_start
+        self.headless = False  # 批量模式下确认提示按策略自动回答
+        self.memory_lock = threading.RLock()
+        self.background_tasks = []
+        
         self.name = "豆星"
         self.root_path = os.path.dirname(os.path.abspath(__file__))
         self.version_file = os.path.join(self.root_path, "version_history.json")
         self.memory_file = os.path.join(self.root_path, "context_memory.json")
+        self.memory_stats_file = os.path.join(self.root_path, MEMORY_CONFIG["stats_file"])
         self.question_bank_file = os.path.join(self.root_path, "game_question_bank.json")
+        self.question_overlay_file = os.path.join(self.root_path, BANK_CONFIG["overlay_file"])
         self.reflection_file = os.path.join(self.root_path, "reflection_log.json")
         self.game_config_file = os.path.join(self.root_path, "game_config.json")
         self.update_config = UPDATE_CONFIG
+        self.update_checker = UpdateChecker(
+            self.update_config["version_check_url"],
+            os.path.join(self.root_path, self.update_config["cache_file"]),
+            self.update_config["timeout"],
+            self.update_config["recheck_interval"]
+        )
+        self.update_status = {"state": "idle"}
+        self.backup_store = BackupStore(self.update_config["backup_dir"], self.update_config["backup_keep"])
+        
+        # 题库和游戏配置的合并写入
+        self.writer = WriteBehindWriter(PERSIST_CONFIG["flush_interval"], PERSIST_CONFIG["flush_threshold"])
+        
+        # 可选的SQLite存储后端
+        self.record_store = None
+        if STORAGE_CONFIG["backend"] == "sqlite":
+            self.record_store = SQLiteRecordStore(os.path.join(self.root_path, STORAGE_CONFIG["sqlite_file"]))
+        
+        self.mark_startup("初始化存储")
         
         # 加载版本历史
         self.version_history = self.load_version_history()
         self.current_version = self.version_history[-1]["version"] if self.version_history else "1.0"
+        self.mark_startup("加载版本历史")
         
         # 加载上下文记忆
         self.context_memory = self.load_memory()
+        self.mark_startup("加载上下文记忆")
         
         # 加载题库
         self.game_question_bank = self.load_question_bank()
+        if isinstance(self.game_question_bank, LayeredQuestionBank):
+            self.writer.register("question_bank", self.question_overlay_file,
+                                 lambda: self.game_question_bank.overlay_snapshot(), self.write_question_overlay)
+        else:
+            self.writer.register("question_bank", self.question_bank_file, lambda: dict(self.game_question_bank))
+        self.mark_startup("加载题库")
+        self.rebuild_question_index()
+        self.mark_startup("构建题目索引")
         
         # 加载反思日志
         self.reflection_log = self.load_reflection_log()
+        self.mark_startup("加载反思日志")
         
         # 加载游戏窗口配置
         self.game_config = self.load_game_config()
+        self.writer.register("game_config", self.game_config_file, lambda: dict(self.game_config))
         self.game_window_title = self.game_config.get("game_window_title", None)
+        self.mark_startup("加载游戏配置")
+        
+        # 截图后端（屏幕或图片回放）
+        if METRICS_CONFIG["sink_file"]:
+            metrics.open_sink(os.path.join(self.root_path, METRICS_CONFIG["sink_file"]))
+        
+        self.window_locator = WindowLocator(create_window_backend(), WINDOW_CONFIG["revalidate_interval"])
+        self.capture_backend = create_capture_backend(CAPTURE_CONFIG, self.window_locator)
+        self.last_capture_origin = (0, 0)
+        
+        # 常驻OCR引擎
+        self.ocr_engine = OCREngine(OCR_CONFIG["lang"], OCR_CONFIG["engine"], OCR_CONFIG["workers"], OCR_CONFIG["tessdata_path"])
+        
+        # OCR结果缓存
+        self.ocr_cache = self.load_ocr_cache()
+        
+        # 图片类答案按钮的模板匹配（首次使用时加载模板）
+        self.template_matcher = TemplateMatcher(
+            os.path.join(self.root_path, TEMPLATE_CONFIG["template_dir"]),
+            TEMPLATE_CONFIG["scales"], TEMPLATE_CONFIG["threshold"],
+            TEMPLATE_CONFIG["scale_step"], TEMPLATE_CONFIG["pyramid_cache_size"]
+        )
         
         # 指令映射
         self.command_map = {
@@ -59,7 +2362,7 @@ class DouXingAI:
             "清理题库": self.clear_question_bank,
             "查看题库": self.show_question_bank,
             "自检": self.check_environment,
-            "截图": self.take_screenshot,
+            "截图": self.save_screenshot,
             "识别文字": self.recognize_chat_text,
             "查看版本": self.show_version_history,
             "查看记忆": self.show_memory,
@@ -69,78 +2372,157 @@ class DouXingAI:
             "查看游戏窗口": self.show_game_config,
             "回顾协作历史": self.review_collaboration_history,
             "检查更新": self.check_for_updates,
-            "更新版本": self.update_version
+            "更新版本": self.update_version,
+            "保存数据": self.flush_persistence,
+            "OCR性能测试": self.benchmark_ocr,
+            "连续答题": self.continuous_answer_flow,
+            "标定区域": self.calibrate_regions,
+            "OCR缓存统计": self.show_ocr_cache_stats,
+            "重载模板": self.reload_templates,
+            "流水线答题": self.pipeline_answer_flow,
+            "设置预处理": self.set_preprocess_steps,
+            "预处理性能测试": self.benchmark_preprocess,
+            "启动耗时": self.show_startup_timings,
+            "更新状态": self.show_update_status,
+            "回滚": self.rollback_version,
+            "整理题库": self.compact_question_bank,
+            "导入题库": self.import_question_bank,
+            "导出题库": self.export_question_bank,
+            "绑定多个窗口": self.bind_game_windows,
+            "多窗口答题": self.multi_window_answer_flow,
+            "窗口定位统计": self.show_window_locator_stats,
+            "性能报告": self.show_performance_report
         }
+        self.mark_startup("初始化组件")
         
         # 启动提示
         print(f"✅ {self.name} 核心已启动，当前版本：{self.current_version}")
         print(f"📁 根目录：{self.root_path}")
         print(f"📚 已加载题库，共 {len(self.game_question_bank)} 道题目")
-        print(f"🧠 已加载上下文记忆，共 {len(self.context_memory)} 条记录")
+        print(f"🧠 已加载上下文记忆，共 {self.count_records(self.context_memory)} 条记录")
         print(f"🤔 已加载反思日志，共 {len(self.reflection_log)} 条记录")
         if self.game_window_title:
             print(f"🎮 已绑定游戏窗口：{self.game_window_title}")
         else:
             print("🎮 未绑定游戏窗口，请使用 '绑定游戏窗口' 指令进行设置")
-        print("💬 智能指令模块已加载！支持的指令：启动答题、学习新题、清理题库、查看题库、自检、截图、识别文字、查看版本、查看记忆、查看反思、反思、绑定游戏窗口、查看游戏窗口、回顾协作历史、检查更新、更新版本")
+        print(f"💬 智能指令模块已加载！支持的指令：{'、'.join(self.command_map)}")
         print("🤝 协作通道已建立：优先识别指令，再处理游戏题目")
         print("🌐 远程更新模块已加载，将自动检查最新版本\n")
         
+        if self.fast_start:
+            # 快速启动：耗时的启动任务放到后台，命令行立即可用
+            self.run_in_background("启动任务", self.run_startup_tasks)
+            self.mark_startup("启动后台任务")
+            self.show_startup_timings()
+        else:
+            self.run_startup_tasks()
+            self.show_startup_timings()
+
+    def run_startup_tasks(self):
         # 启动时自动检查更新
         if self.update_config["auto_check_update"]:
             self.check_for_updates(automatic=True)
+            self.mark_startup("检查更新")
         
         # 启动时自动回顾协作历史
         self.review_collaboration_history()
+        self.mark_startup("回顾协作历史")
         # 启动时自动反思
         self.self_reflection()
+        self.mark_startup("自我反思")
+
+    # ========== 启动计时与后台任务 ==========
+    def mark_startup(self, phase):
+        """记录本线程从上一个阶段结束到现在的耗时"""
+        now = time.perf_counter()
+        started = getattr(self.phase_clock, "started", self.startup_started)
+        self.phase_clock.started = now
+        with self.memory_lock:
+            self.startup_timings.append((phase, (now - started) * 1000, threading.current_thread().name))
+
+    def show_startup_timings(self):
+        print("⏱️ 启动耗时明细：")
+        for phase, elapsed_ms, thread_name in list(self.startup_timings):
+            where = "" if thread_name == "MainThread" else "（后台）"
+            print(f"   - {phase}{where}：{elapsed_ms:.1f} ms")
+        foreground = sum(ms for _, ms, t in self.startup_timings if t == "MainThread")
+        print(f"   - 前台合计：{foreground:.1f} ms\n")
+
+    def run_in_background(self, name, func, *args):
+        thread = threading.Thread(target=self._background_wrapper, args=(name, func) + args,
+                                  name=f"douxing-{name}", daemon=True)
+        self.background_tasks.append(thread)
+        thread.start()
+        return thread
+
+    def _background_wrapper(self, name, func, *args):
+        self.phase_clock.started = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"⚠️ 后台任务「{name}」出错：{e}")
+
+    def pause(self, seconds):
+        """演示用的停顿，快速启动模式下跳过"""
+        if not self.fast_start:
+            time.sleep(seconds)
 
     # ========== 远程版本控制与自动更新 ==========
     def load_version_history(self):
+        if self.record_store is not None:
+            history = self.record_store.table("version_history", "date", self.version_file)
+            if not len(history):
+                history.extend(self.default_version_history())
+            return history
         try:
             if os.path.exists(self.version_file):
                 with open(self.version_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
             else:
-                init_history = [
-                    {
-                        "version": "1.0",
-                        "date": "2026-02-21 18:00:00",
-                        "description": "初始版本：基础答题+自动学习"
-                    },
-                    {
-                        "version": "4.1",
-                        "date": "2026-02-21 18:30:00",
-                        "description": "智能协作版：精准区分指令+题目，具备上下文记忆和版本历史"
-                    },
-                    {
-                        "version": "4.2",
-                        "date": "2026-02-21 19:00:00",
-                        "description": "自我反思版：具备自我反思和优化建议能力"
-                    },
-                    {
-                        "version": "4.3",
-                        "date": "2026-02-21 19:30:00",
-                        "description": "游戏窗口识别版：支持精准绑定和识别游戏窗口"
-                    },
-                    {
-                        "version": "4.4",
-                        "date": "2026-02-21 20:00:00",
-                        "description": "上下文记忆增强版：自动记录协作历史，启动时回顾，更智能地理解意图"
-                    },
-                    {
-                        "version": "4.5",
-                        "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-                        "description": "远程迭代版：支持远程自动版本更新、备份与回滚"
-                    }
-                ]
+                init_history = self.default_version_history()
                 self.save_version_history(init_history)
                 return init_history
         except:
             print("⚠️ 版本历史加载失败，使用初始版本")
             return []
 
+    def default_version_history(self):
+        return [
+            {
+                "version": "1.0",
+                "date": "2026-02-21 18:00:00",
+                "description": "初始版本：基础答题+自动学习"
+            },
+            {
+                "version": "4.1",
+                "date": "2026-02-21 18:30:00",
+                "description": "智能协作版：精准区分指令+题目，具备上下文记忆和版本历史"
+            },
+            {
+                "version": "4.2",
+                "date": "2026-02-21 19:00:00",
+                "description": "自我反思版：具备自我反思和优化建议能力"
+            },
+            {
+                "version": "4.3",
+                "date": "2026-02-21 19:30:00",
+                "description": "游戏窗口识别版：支持精准绑定和识别游戏窗口"
+            },
+            {
+                "version": "4.4",
+                "date": "2026-02-21 20:00:00",
+                "description": "上下文记忆增强版：自动记录协作历史，启动时回顾，更智能地理解意图"
+            },
+            {
+                "version": "4.5",
+                "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                "description": "远程迭代版：支持远程自动版本更新、备份与回滚"
+            }
+        ]
+
     def save_version_history(self, history=None):
+        if self.record_store is not None:
+            return  # SQLite 后端在追加时已落盘
         if history is None:
             history = self.version_history
         try:
@@ -165,33 +2547,69 @@ class DouXingAI:
                 sha256_hash.update(byte_block)
         return sha256_hash.hexdigest()
 
-    def backup_current_version(self):
-        """备份当前版本代码"""
-        if not os.path.exists(self.update_config["backup_dir"]):
-            os.makedirs(self.update_config["backup_dir"])
-        
-        backup_file = os.path.join(self.update_config["backup_dir"], f"douxing_core_{self.current_version}_{int(time.time())}.py")
+    def backup_current_version(self, protect=()):
+        """备份当前版本代码到备份库；内容与已有备份相同时不重复保存"""
         current_file = os.path.abspath(__file__)
-        
         try:
-            shutil.copy2(current_file, backup_file)
-            print(f"✅ 当前版本已备份到：{backup_file}")
-            return backup_file
+            file_hash, created = self.backup_store.backup(self.current_version, current_file, protect)
+            if created:
+                print(f"✅ 当前版本 {self.current_version} 已备份（{file_hash[:12]}）")
+            else:
+                print(f"✅ 当前版本 {self.current_version} 与已有备份内容相同，无需重复保存（{file_hash[:12]}）")
+            return self.backup_store.object_path(file_hash)
         except Exception as e:
             print(f"❌ 备份失败：{e}")
             return None
 
-    def get_remote_version_info(self):
-        """从远程服务器获取最新版本信息"""
+    def rollback_version(self):
+        """从备份库恢复任意已备份的版本"""
+        versions = self.backup_store.versions()
+        if not versions:
+            print("📭 备份库为空，暂无可回滚的版本")
+            return
+        print("\n📦 可回滚的版本：")
+        for version, entry in versions:
+            print(f"  {version}（{entry['time']}，{entry['hash'][:12]}，{entry['size']} 字节）")
+        label = self.ask("请输入要回滚到的版本号：", "rollback_version").strip()
+        if label not in self.backup_store.index:
+            print(f"❌ 备份库中没有版本 {label}")
+            return
+        version = self.backup_store.version_of(label)
+        
+        current_file = os.path.abspath(__file__)
+        try:
+            # 回滚前先备份当前文件，方便再切回来；目标版本即使是最旧的一个也不能被这次备份挤掉
+            target_hash = self.backup_store.index[label]["hash"]
+            self.backup_current_version(protect=(target_hash,))
+            # 当前版本号与目标相同时，这次备份会把目标条目改名为别名，按哈希重新找到它
+            self.backup_store.restore(self.backup_store.label_of(target_hash), current_file)
+        except Exception as e:
+            print(f"❌ 回滚失败：{e}")
+            return
+        # 版本历史决定启动后的当前版本号，回滚后要同步，否则检查更新会认为已是最新
+        self.version_history.append({
+            "version": version,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+            "description": f"从版本 {self.current_version} 回滚到版本 {version}"
+        })
+        self.save_version_history()
+        self.current_version = version
+        self.add_memory(f"回滚到版本 {version}", "system", "update")
+        print(f"✅ 已回滚到版本 {version}")
+        print("🔄 请重启豆星使回滚生效")
+
+    def get_remote_version_info(self, force=True):
+        """从远程服务器获取最新版本信息；force=False 时间隔内直接使用本地缓存"""
         try:
-            response = requests.get(
-                self.update_config["version_check_url"],
-                timeout=self.update_config["timeout"]
-            )
-            if response.status_code == 200:
-                return json.loads(response.text)
+            result = self.update_checker.fetch(force)
+            if result["info"] is not None:
+                if result["source"] == "cache":
+                    print("📦 距上次检查未超过最短间隔，使用缓存的版本信息")
+                elif result["source"] == "not_modified":
+                    print("📦 版本信息未变化（304），使用缓存")
+                return result["info"]
             else:
-                print(f"❌ 获取版本信息失败，状态码：{response.status_code}")
+                print(f"❌ 获取版本信息失败，状态码：{result['status_code']}")
                 return None
         except requests.exceptions.Timeout:
             print("❌ 连接更新服务器超时")
@@ -203,39 +2621,177 @@ class DouXingAI:
             print(f"❌ 获取版本信息出错：{e}")
             return None
 
-    def download_remote_file(self, url, save_path):
-        """下载远程文件"""
+    def download_full_update(self, version_info, temp_file):
+        """下载完整的新版本文件；按版本号命名，中断后下次更新可以断点续传"""
+        print(f"📥 正在下载新版本文件：{version_info['download_url']}")
+        return self.download_remote_file(version_info["download_url"], temp_file)
+
+    def apply_delta_update(self, version_info, temp_file):
+        """version.json 的 patches 中有以当前版本为基础的补丁时，下载补丁并生成新文件。
+        成功返回新文件哈希（已与 file_hash 核对），否则返回 None 交给完整下载"""
+        patch_info = (version_info.get("patches") or {}).get(self.current_version)
+        target_hash = version_info.get("file_hash")
+        if not patch_info or not target_hash:
+            return None
+        
+        current_file = os.path.abspath(__file__)
+        if patch_info.get("base_hash") and self.calculate_file_hash(current_file) != patch_info["base_hash"]:
+            print("⚠️ 本地文件与补丁基础版本不一致（可能被手动修改过），改为完整下载")
+            return None
+        
+        patch_file = temp_file + ".patch"
+        print(f"📥 正在下载增量补丁：{patch_info['url']}")
         try:
-            response = requests.get(url, timeout=self.update_config["timeout"])
-            if response.status_code == 200:
-                with open(save_path, 'wb') as f:
-                    f.write(response.content)
-                return True
+            patch_hash = self.download_remote_file(patch_info["url"], patch_file)
+            if not patch_hash:
+                return None
+            if patch_info.get("hash") and patch_hash != patch_info["hash"]:
+                print("⚠️ 补丁校验失败，改为完整下载")
+                return None
+            
+            with open(current_file, "rb") as f:
+                old_data = f.read()
+            with open(patch_file, "rb") as f:
+                new_data = apply_line_patch(old_data, f.read())
+            file_hash = hashlib.sha256(new_data).hexdigest()
+            if file_hash != target_hash:
+                print("⚠️ 打补丁后的文件哈希不符，改为完整下载")
+                return None
+            
+            with open(temp_file, "wb") as f:
+                f.write(new_data)
+                f.flush()
+                os.fsync(f.fileno())
+            print(f"✅ 增量更新完成：补丁 {os.path.getsize(patch_file)} 字节，新文件 {len(new_data)} 字节")
+            return file_hash
+        except Exception as e:
+            print(f"⚠️ 增量补丁应用失败：{e}，改为完整下载")
+            return None
+        finally:
+            if os.path.exists(patch_file):
+                os.remove(patch_file)
+
+    def download_remote_file(self, url, save_path):
+        """流式下载远程文件：边下载边计算SHA-256，中断后用HTTP Range断点续传，
+        完成后原子重命名到 save_path。成功返回文件哈希，失败返回 None"""
+        part_path = save_path + ".part"
+        meta_path = save_path + ".part.json"
+        for attempt in range(1, self.update_config["download_retries"] + 1):
+            try:
+                file_hash = self._download_part(url, part_path, meta_path)
+                if file_hash:
+                    os.replace(part_path, save_path)
+                    if os.path.exists(meta_path):
+                        os.remove(meta_path)
+                    return file_hash
+                return None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, DownloadInterrupted) as e:
+                downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                print(f"⚠️ 下载中断（第{attempt}次）：{e}，已下载 {downloaded} 字节，准备续传")
+            except Exception as e:
+                print(f"❌ 文件下载出错：{e}")
+                return None
+        print("❌ 多次重试后仍未下载完成，已保留部分文件，下次更新时继续")
+        return None
+
+    def _download_part(self, url, part_path, meta_path):
+        sha256_hash = hashlib.sha256()
+        offset = 0
+        etag = None
+        if os.path.exists(part_path) and os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get("url") == url:
+                    etag = meta.get("etag")
+                    offset = os.path.getsize(part_path)
+            except:
+                offset = 0
+        
+        headers = {}
+        if offset:
+            # 已有的部分要先计入哈希；If-Range保证服务器文件变了时返回完整内容
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(self.update_config["download_chunk_size"]), b""):
+                    sha256_hash.update(block)
+            headers["Range"] = f"bytes={offset}-"
+            if etag:
+                headers["If-Range"] = etag
+        
+        session = self.update_checker.session()
+        with session.get(url, headers=headers, stream=True, timeout=self.update_config["timeout"]) as response:
+            if response.status_code == 206:
+                # Content-Range 形如 "bytes 起始-结束/总长"，起始位置必须正好接在本地文件末尾
+                content_range = response.headers.get("Content-Range", "")
+                match = re.match(r"bytes\s+(\d+)-", content_range)
+                if not match or int(match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise DownloadInterrupted(f"续传位置不一致（{content_range or '缺少Content-Range'}），重新下载")
+                mode = 'ab'
+                print(f"📥 从第 {offset} 字节继续下载")
+            elif response.status_code == 200:
+                mode = 'wb'
+                offset = 0
+                sha256_hash = hashlib.sha256()
+            elif response.status_code == 416 and offset:
+                # 本地部分文件与服务器不一致，从头下载
+                os.remove(part_path)
+                raise DownloadInterrupted("续传范围无效，重新下载")
             else:
                 print(f"❌ 文件下载失败，状态码：{response.status_code}")
-                return False
-        except Exception as e:
-            print(f"❌ 文件下载出错：{e}")
-            return False
+                return None
+            
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"url": url, "etag": response.headers.get("ETag")}, f)
+            
+            expected = response.headers.get("Content-Length")
+            received = 0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.update_config["download_chunk_size"]):
+                    if chunk:
+                        f.write(chunk)
+                        sha256_hash.update(chunk)
+                        received += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            if expected is not None and received < int(expected):
+                raise DownloadInterrupted(f"连接提前关闭（{received}/{expected} 字节）")
+        return sha256_hash.hexdigest()
 
-    def check_for_updates(self, automatic=False):
-        """检查远程服务器是否有新版本"""
+    def check_for_updates(self, automatic=False, background=None, callback=None):
+        """检查远程服务器是否有新版本；自动检查默认在后台进行，不阻塞启动，
+        结果通过 callback(版本信息) 返回，也可用 '更新状态' 指令查看"""
+        if background is None:
+            background = automatic
+        if background:
+            self.update_status = {"state": "checking", "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
+            self.run_in_background("检查更新", self.check_for_updates, automatic, False, callback)
+            return None
+        
         print("\n🌐 正在检查远程更新...")
-        time.sleep(1)
+        self.pause(1)
+        self.update_status = {"state": "checking", "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())}
         
-        # 获取远程版本信息
-        remote_info = self.get_remote_version_info()
+        # 获取远程版本信息（自动检查遵守最短间隔，手动检查总是询问服务器）
+        remote_info = self.get_remote_version_info(force=not automatic)
+        checked_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
         if not remote_info:
             print("⚠️ 无法获取远程版本信息，使用本地版本")
+            self.update_status = {"state": "failed", "checked_at": checked_at}
+            if callback:
+                callback(None)
             return None
         
-        # 版本号比较（x.y格式）
-        def version_to_num(version):
-            parts = version.split('.')
-            return int(parts[0]) * 100 + int(parts[1]) if len(parts)>=2 else int(parts[0])
-        
         current_num = version_to_num(self.current_version)
         latest_num = version_to_num(remote_info["latest_version"])
+        self.update_status = {
+            "state": "done",
+            "checked_at": checked_at,
+            "latest_version": remote_info["latest_version"],
+            "has_update": latest_num > current_num,
+            "description": remote_info.get("description", "")
+        }
         
         if latest_num > current_num:
             print(f"🎉 发现远程新版本：{remote_info['latest_version']}")
@@ -243,8 +2799,7 @@ class DouXingAI:
             print(f"📝 更新说明：{remote_info['description']}")
             
             if not automatic:
-                confirm = input("\n是否立即更新？(y/n)：")
-                if confirm.lower() == "y":
+                if self.confirm("\n是否立即更新？(y/n)："):
                     self.update_version(remote_info)
             else:
                 print("🔄 自动更新模式：建议手动执行 '更新版本' 指令")
@@ -252,8 +2807,30 @@ class DouXingAI:
         else:
             print("✅ 当前已是最新版本")
         
+        if callback:
+            callback(remote_info)
         return remote_info
 
+    def show_update_status(self):
+        """查看最近一次（含后台）更新检查的结果"""
+        status = self.update_status
+        print("\n🌐 更新检查状态：")
+        if status["state"] == "idle":
+            print("   - 尚未检查更新")
+        elif status["state"] == "checking":
+            print(f"   - 正在后台检查（开始于 {status['started_at']}）")
+        elif status["state"] == "failed":
+            print(f"   - 检查失败（{status['checked_at']}），无法获取远程版本信息")
+        else:
+            print(f"   - 检查时间：{status['checked_at']}")
+            print(f"   - 当前版本：{self.current_version}，远程最新版本：{status['latest_version']}")
+            if status["has_update"]:
+                print(f"   - 🎉 有新版本可用：{status['description']}（执行 '更新版本' 指令更新）")
+            else:
+                print("   - ✅ 当前已是最新版本")
+        print()
+        return status
+
     def update_version(self, version_info=None):
         """从远程服务器更新版本"""
         if version_info is None:
@@ -263,10 +2840,6 @@ class DouXingAI:
                 return
         
         # 检查版本号
-        def version_to_num(version):
-            parts = version.split('.')
-            return int(parts[0]) * 100 + int(parts[1]) if len(parts)>=2 else int(parts[0])
-        
         current_num = version_to_num(self.current_version)
         latest_num = version_to_num(version_info["latest_version"])
         
@@ -282,17 +2855,17 @@ class DouXingAI:
             print("❌ 备份失败，取消更新")
             return
         
-        # 2. 下载新版本文件
-        temp_file = os.path.join(self.root_path, f"douxing_core_temp_{int(time.time())}.py")
-        print(f"📥 正在下载新版本文件：{version_info['download_url']}")
-        
-        if not self.download_remote_file(version_info["download_url"], temp_file):
+        # 2. 优先使用增量补丁，没有对应补丁或补丁失败时下载完整文件
+        temp_file = os.path.join(self.root_path, f"douxing_core_{version_info['latest_version']}.download")
+        file_hash = self.apply_delta_update(version_info, temp_file)
+        if not file_hash:
+            file_hash = self.download_full_update(version_info, temp_file)
+        if not file_hash:
             print("❌ 文件下载失败，正在回滚...")
             return
         
-        # 3. 校验文件完整性
+        # 3. 校验文件完整性（哈希已在下载或打补丁过程中算好）
         if version_info.get("file_hash") and version_info["file_hash"] != "":
-            file_hash = self.calculate_file_hash(temp_file)
             if file_hash != version_info["file_hash"]:
                 print(f"❌ 文件校验失败！本地哈希：{file_hash}，服务器哈希：{version_info['file_hash']}")
                 os.remove(temp_file)
@@ -326,7 +2899,7 @@ class DouXingAI:
             
             # 删除临时文件
             if os.path.exists(old_file):
-                print(f"📌 旧版本已保存为：{old_file}（如需回滚可手动替换）")
+                print(f"📌 旧版本已保存为：{old_file}（也可使用“回滚”指令恢复备份库中的任意版本）")
                 
         except Exception as e:
             print(f"❌ 更新失败：{e}，正在回滚...")
@@ -341,28 +2914,68 @@ class DouXingAI:
 
     # ========== 上下文记忆 ==========
     def load_memory(self):
+        if self.record_store is not None:
+            memory = self.record_store.table("context_memory", "timestamp", self.memory_file)
+            if not len(memory):
+                memory.extend(self.default_memory())
+            return memory
+        entries, stats = [], None
         try:
             if os.path.exists(self.memory_file):
                 with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    entries = json.load(f)
             else:
-                init_memory = [
-                    {
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-                        "content": "豆星启动，开始与用户协作构建自我。核心目标：优先识别指令，记录协作历史，迭代升级，精准识别游戏窗口，支持远程自动更新。",
-                        "type": "system",
-                        "category": "goal"
-                    }
-                ]
-                self.save_memory(init_memory)
-                return init_memory
+                entries = self.default_memory()
+                self.save_memory(entries)
         except:
-            print("⚠️ 上下文记忆加载失败，使用初始记忆")
-            return []
+            # 损坏的记忆文件改名保留，不会被接下来的写入覆盖
+            broken = self.memory_file + ".broken"
+            try:
+                os.replace(self.memory_file, broken)
+                print(f"⚠️ 上下文记忆加载失败，原文件已另存为 {broken}，使用初始记忆")
+            except OSError:
+                print("⚠️ 上下文记忆加载失败，使用初始记忆")
+            entries = []
+        # 计数文件单独加载：丢失或损坏时由记录和归档分段重建，不影响记录本身
+        try:
+            if os.path.exists(self.memory_stats_file):
+                with open(self.memory_stats_file, 'r', encoding='utf-8') as f:
+                    stats = json.load(f)
+        except:
+            print("⚠️ 记忆计数加载失败，将由记录和归档分段重建")
+            stats = None
+        memory = TieredMemory(
+            os.path.join(self.root_path, MEMORY_CONFIG["archive_dir"]),
+            MEMORY_CONFIG["hot_size"], MEMORY_CONFIG["segment_size"], entries, stats
+        )
+        self.writer.register("context_memory", self.memory_file, memory.snapshot)
+        self.writer.register("memory_stats", self.memory_stats_file, memory.stats)
+        if stats is None or len(memory) < len(entries):
+            # 计数是新建的或刚归档过旧记录，立即写入保持记录、计数和分段一致
+            self.writer.mark_dirty("context_memory")
+            self.writer.mark_dirty("memory_stats")
+            self.writer.flush("context_memory")
+            self.writer.flush("memory_stats")
+        return memory
+
+    def default_memory(self):
+        return [
+            {
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                "content": "豆星启动，开始与用户协作构建自我。核心目标：优先识别指令，记录协作历史，迭代升级，精准识别游戏窗口，支持远程自动更新。",
+                "type": "system",
+                "category": "goal"
+            }
+        ]
 
     def save_memory(self, memory=None):
+        """传入memory时立即写入，否则标记最近记录和计数待写入"""
+        if self.record_store is not None:
+            return  # SQLite 后端在追加时已落盘
         if memory is None:
-            memory = self.context_memory
+            self.writer.mark_dirty("context_memory")
+            self.writer.mark_dirty("memory_stats")
+            return
         try:
             with open(self.memory_file, 'w', encoding='utf-8') as f:
                 json.dump(memory, f, ensure_ascii=False, indent=4)
@@ -376,31 +2989,63 @@ class DouXingAI:
             "type": memory_type,
             "category": category
         }
-        self.context_memory.append(new_entry)
-        self.save_memory()
+        # 后台启动任务和命令行可能同时写入记忆
+        with self.memory_lock:
+            archived = self.context_memory.append(new_entry)
+            self.save_memory()
+            if archived:
+                # 刚归档的记录要马上从 context_memory.json 中去掉，避免与归档分段重复
+                self.writer.flush("context_memory")
+                self.writer.flush("memory_stats")
         print(f"🧠 已添加新记忆：{content}")
 
-    def show_memory(self, category=None):
+    def query_records(self, records, categories=None, since=None, until=None, time_field="timestamp", recent_only=False):
+        """按类别和时间范围筛选记录：SQLite后端走索引，分层记忆只解压时间范围相交的归档分段；
+        recent_only 时只看最近的记录"""
+        if isinstance(records, SQLiteRecordList):
+            limit = MEMORY_CONFIG["hot_size"] if recent_only else None
+            return records.query(categories=categories, since=since, until=until, limit=limit)
+        if isinstance(records, TieredMemory):
+            return records.query(categories=categories, since=since, until=until, include_archive=not recent_only)
+        return [
+            m for m in records
+            if (not categories or m.get("category") in categories)
+            and (not since or m.get(time_field, "") >= since)
+            and (not until or m.get(time_field, "") <= until)
+        ]
+
+    def count_records(self, records, categories=None):
+        if isinstance(records, (SQLiteRecordList, TieredMemory)):
+            return records.count(categories=categories)
+        return len([m for m in records if not categories or m.get("category") in categories])
+
+    def show_memory(self, category=None, since=None, until=None):
         print("\n🧠 豆星上下文记忆：")
         filtered_memory = self.context_memory
-        if category:
-            filtered_memory = [m for m in self.context_memory if m.get("category") == category]
-            print(f"🔍 筛选类别：{category}")
+        if category or since or until:
+            filtered_memory = self.query_records(self.context_memory, [category] if category else None, since, until)
+            if category:
+                print(f"🔍 筛选类别：{category}")
+            if since or until:
+                print(f"🔍 时间范围：{since or '最早'} ~ {until or '最新'}")
         
         if not filtered_memory:
             print("暂无记忆")
         else:
             for i, entry in enumerate(filtered_memory, 1):
                 print(f"{i}. [{entry['timestamp']}] [{entry['category']}] {entry['type']}: {entry['content']}")
+            archived = self.count_records(self.context_memory) - len(self.context_memory)
+            if filtered_memory is self.context_memory and archived > 0:
+                print(f"📦 另有 {archived} 条较早的记录已归档，可按类别或时间范围查看")
         print()
 
     def review_collaboration_history(self):
         """启动时自动回顾协作历史"""
         print("\n📜 豆星正在回顾协作历史...")
-        time.sleep(1)
+        self.pause(1)
         
         # 提取关键协作事件
-        key_events = [m for m in self.context_memory if m.get("category") in ["goal", "system", "instruction"]]
+        key_events = self.query_records(self.context_memory, ["goal", "system", "instruction"], recent_only=True)
         
         if not key_events:
             print("暂无协作历史")
@@ -411,7 +3056,7 @@ class DouXingAI:
             print(f"{i}. [{event['timestamp']}] {event['content']}")
         
         # 生成协作总结
-        total_instructions = len([m for m in self.context_memory if m.get("category") == "instruction"])
+        total_instructions = self.count_records(self.context_memory, ["instruction"])
         total_questions = len(self.game_question_bank)
         total_reflections = len(self.reflection_log)
         
@@ -426,6 +3071,8 @@ class DouXingAI:
 
     # ========== 自我反思 ==========
     def load_reflection_log(self):
+        if self.record_store is not None:
+            return self.record_store.table("reflection_log", "timestamp", self.reflection_file)
         try:
             if os.path.exists(self.reflection_file):
                 with open(self.reflection_file, 'r', encoding='utf-8') as f:
@@ -437,6 +3084,8 @@ class DouXingAI:
             return []
 
     def save_reflection_log(self, log=None):
+        if self.record_store is not None:
+            return  # SQLite 后端在追加时已落盘
         if log is None:
             log = self.reflection_log
         try:
@@ -448,12 +3097,12 @@ class DouXingAI:
     def self_reflection(self):
         """豆星自我反思：评估当前状态，生成优化建议"""
         print("\n🤔 豆星正在自我反思...")
-        time.sleep(1)
+        self.pause(1)
         
         # 评估维度
         assessment = {
             "指令识别准确率": "高（已精准区分指令与题目）",
-            "上下文记忆完整性": "高（已自动记录协作历史，启动时回顾）" if len(self.context_memory) > 10 else "中（已记录启动目标，需补充更多协作历史）",
+            "上下文记忆完整性": "高（已自动记录协作历史，启动时回顾）" if self.count_records(self.context_memory) > 10 else "中（已记录启动目标，需补充更多协作历史）",
             "游戏窗口识别能力": "高（已支持精准绑定和识别游戏窗口）" if self.game_window_title else "低（当前仅支持全屏截图，需优化）",
             "自我迭代能力": "高（已支持远程自动版本更新、备份与回滚）"
         }
@@ -462,7 +3111,7 @@ class DouXingAI:
         suggestions = []
         if not self.game_window_title:
             suggestions.append("下一步：使用 '绑定游戏窗口' 指令，精准定位游戏窗口。")
-        if len(self.context_memory) <= 10:
+        if self.count_records(self.context_memory) <= 10:
             suggestions.append("下一步：继续执行指令，丰富协作历史记忆。")
         suggestions.append("下一步：扩展更多游戏自动化功能，如自动挂机、定时答题等。")
         
@@ -473,8 +3122,9 @@ class DouXingAI:
             "suggestions": suggestions
         }
         
-        self.reflection_log.append(reflection_entry)
-        self.save_reflection_log()
+        with self.memory_lock:
+            self.reflection_log.append(reflection_entry)
+            self.save_reflection_log()
         self.add_memory(f"自我反思：{json.dumps(assessment, ensure_ascii=False)}，建议：{json.dumps(suggestions, ensure_ascii=False)}", "system", "reflection")
         
         print("📊 自我评估：")
@@ -510,26 +3160,48 @@ class DouXingAI:
             return {}
 
     def save_game_config(self, config=None):
+        """传入config时立即原子写入，否则标记为待写入，由合并写入器落盘"""
         if config is None:
-            config = self.game_config
+            self.writer.mark_dirty("game_config")
+            return
         try:
-            with open(self.game_config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=4)
+            atomic_write_json(self.game_config_file, config)
             print(f"✅ 游戏配置已保存到：{self.game_config_file}")
         except Exception as e:
             print(f"❌ 游戏配置保存失败：{e}")
 
     def list_all_windows(self):
         """列出所有可见窗口标题"""
-        windows = []
-        def callback(hwnd, extra):
-            if win32gui.IsWindowVisible(hwnd):
-                title = win32gui.GetWindowText(hwnd)
-                if title:
-                    windows.append(title)
-            return True
-        win32gui.EnumWindows(callback, None)
-        return windows
+        return self.window_locator.list_titles()
+
+    def show_performance_report(self):
+        """各阶段耗时的次数、平均值和 p50/p95/p99 分位数"""
+        summary = metrics.summary()
+        print("\n⏱️ 性能报告（单位：毫秒）：")
+        if not summary:
+            print("暂无计时数据，请先执行答题等操作")
+            print()
+            return summary
+        print(f"   {'阶段':<14}{'次数':>8}{'平均':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}")
+        stages = [stage for stage in METRIC_LABELS if stage in summary] + sorted(set(summary) - set(METRIC_LABELS))
+        for stage in stages:
+            stat = summary[stage]
+            print(f"   {METRIC_LABELS.get(stage, stage):<14}{stat['count']:>8}{stat['avg_ms']:>10.3f}{stat['p50_ms']:>10.3f}"
+                  f"{stat['p95_ms']:>10.3f}{stat['p99_ms']:>10.3f}{stat['max_ms']:>10.3f}")
+        if metrics.sink_path:
+            print(f"📝 每次计时明细：{metrics.sink_path}")
+        print()
+        return summary
+
+    def show_window_locator_stats(self):
+        stats = self.window_locator.stats
+        print("\n🪟 窗口定位统计：")
+        print(f"   - 直接使用缓存：{stats['hits']} 次")
+        print(f"   - 轻量校验（句柄+位置）：{stats['revalidations']} 次，其中窗口移动 {stats['moves']} 次")
+        print(f"   - 按标题重新查找：{stats['lookups']} 次")
+        print(f"   - 切换前台：{stats['focus_switches']} 次，已在前台跳过 {stats['focus_skipped']} 次")
+        print(f"   - 平台实现：{type(self.window_locator.backend).__name__}")
+        print()
 
     def bind_game_window(self):
         """绑定游戏窗口"""
@@ -544,7 +3216,7 @@ class DouXingAI:
             print(f"{i}. {title}")
         
         try:
-            choice = int(input("\n请输入游戏窗口的序号："))
+            choice = int(self.ask("\n请输入游戏窗口的序号：", "game_window"))
             if 1 <= choice <= len(windows):
                 self.game_window_title = windows[choice-1]
                 self.game_config["game_window_title"] = self.game_window_title
@@ -556,6 +3228,33 @@ class DouXingAI:
         except ValueError:
             print("❌ 请输入数字")
 
+    def bind_game_windows(self):
+        """绑定多个游戏窗口，供多窗口答题使用"""
+        print("\n🎮 正在绑定多个游戏窗口...")
+        windows = self.list_all_windows()
+        if not windows:
+            print("❌ 未找到任何可见窗口")
+            return
+        
+        print("📋 可用窗口列表：")
+        for i, title in enumerate(windows, 1):
+            print(f"{i}. {title}")
+        
+        try:
+            text = self.ask("\n请输入游戏窗口的序号（多个用逗号分隔）：", "game_windows")
+            choices = [int(p) for p in text.replace("，", ",").split(",") if p.strip()]
+        except ValueError:
+            print("❌ 请输入数字")
+            return
+        if not choices or any(not 1 <= c <= len(windows) for c in choices):
+            print("❌ 无效的序号")
+            return
+        titles = list(dict.fromkeys(windows[c - 1] for c in choices))
+        self.game_config["game_windows"] = titles
+        self.save_game_config()
+        self.add_memory(f"绑定多个游戏窗口：{'、'.join(titles)}", "system", "instruction")
+        print(f"✅ 已绑定 {len(titles)} 个游戏窗口：{'、'.join(titles)}")
+
     def show_game_config(self):
         """查看游戏窗口配置"""
         print("\n🎮 当前游戏窗口配置：")
@@ -563,10 +3262,255 @@ class DouXingAI:
             print(f"✅ 已绑定游戏窗口：{self.game_window_title}")
         else:
             print("❌ 未绑定游戏窗口")
+        if self.game_config.get("game_windows"):
+            print(f"🪟 多窗口答题：{'、'.join(self.game_config['game_windows'])}")
+        rois = self.game_config.get("rois", {})
+        if rois.get("question"):
+            print(f"📐 题目区域：{rois['question']}")
+        for name, box in rois.get("options", {}).items():
+            print(f"📐 选项区域 {name}：{box}")
+        if rois:
+            print(f"📐 标定时窗口尺寸：{self.game_config.get('roi_reference_size')}")
+        print(f"🧪 OCR预处理步骤：{self.preprocess_steps() or '仅灰度化'}")
         print()
 
+    # ========== 识别区域（ROI） ==========
+    def parse_roi_input(self, text):
+        """解析 'x,y,宽,高' 格式的区域输入"""
+        parts = [int(p) for p in text.replace("，", ",").split(",")]
+        if len(parts) != 4 or parts[2] <= 0 or parts[3] <= 0:
+            raise ValueError(text)
+        return parts
+
+    def select_rois(self, frame, prompt, multiple=False):
+        """用OpenCV框选区域，环境不支持或批量模式时退回手动输入坐标"""
+        try:
+            if self.headless:
+                raise RuntimeError("批量模式不弹出框选窗口")
+            import numpy as np
+            image = cv2.cvtColor(np.array(frame.convert("RGB")), cv2.COLOR_RGB2BGR)
+            if multiple:
+                boxes = [list(map(int, b)) for b in cv2.selectROIs(prompt, image, showCrosshair=True)]
+            else:
+                box = list(map(int, cv2.selectROI(prompt, image, showCrosshair=True)))
+                boxes = [box] if box[2] and box[3] else []
+            cv2.destroyWindow(prompt)
+            return boxes
+        except Exception:
+            boxes = []
+            while True:
+                text = self.ask(f"{prompt}（格式：x,y,宽,高，直接回车结束）：", "roi").strip()
+                if not text:
+                    return boxes
+                try:
+                    boxes.append(self.parse_roi_input(text))
+                except ValueError:
+                    print("❌ 格式错误，请输入4个正整数，例如：100,200,300,50")
+                    continue
+                if not multiple:
+                    return boxes
+
+    def calibrate_regions(self):
+        """从当前截图标定题目区域和答案选项区域（坐标相对于游戏窗口）"""
+        print("\n📐 正在标定识别区域...")
+        frame = self.take_screenshot(save=True)
+        print(f"📏 当前画面尺寸：{frame.width}x{frame.height}（可打开截图文件查看坐标）")
+        
+        question = self.select_rois(frame, "框选题目区域")
+        if not question:
+            print("❌ 未标定题目区域，取消标定")
+            return
+        options = {}
+        for i, box in enumerate(self.select_rois(frame, "依次框选答案选项区域", multiple=True)):
+            options[chr(ord("A") + i)] = box
+        if not options:
+            print("ℹ️ 未标定选项区域，答题时在题目区域下方的文字行中查找答案")
+        
+        self.game_config["rois"] = {"question": question[0], "options": options}
+        self.game_config["roi_reference_size"] = [frame.width, frame.height]
+        self.save_game_config()
+        self.add_memory(f"标定识别区域：题目{question[0]}，选项{len(options)}个", "system", "instruction")
+        print(f"✅ 已标定题目区域 {question[0]} 和 {len(options)} 个选项区域")
+
+    def roi_box(self, box, frame_size):
+        """把标定的 [x,y,宽,高] 按当前窗口尺寸缩放，返回 (左,上,右,下)"""
+        ref = self.game_config.get("roi_reference_size") or frame_size
+        frame_size = frame_size or ref
+        sx = frame_size[0] / ref[0]
+        sy = frame_size[1] / ref[1]
+        x, y, w, h = box
+        left, top = int(x * sx), int(y * sy)
+        right = min(frame_size[0], int((x + w) * sx))
+        bottom = min(frame_size[1], int((y + h) * sy))
+        return left, top, right, bottom
+
+    def option_regions(self, frame):
+        """返回 [(选项名, (左,上,右,下))]"""
+        options = self.game_config.get("rois", {}).get("options", {})
+        return [(name, self.roi_box(box, frame.size)) for name, box in options.items()]
+
+    def layout_box(self, frame):
+        """单次OCR的范围：已标定区域时取题目和选项区域的外接矩形，否则为整帧；
+        只标定了题目区域时，取题目区域顶端到画面底部的整宽区域，选项在题目下方的文字行中查找"""
+        rois = self.game_config.get("rois", {})
+        boxes = [box for box in [rois.get("question")] + list(rois.get("options", {}).values()) if box]
+        if not boxes:
+            return (0, 0, frame.size[0], frame.size[1])
+        boxes = [self.roi_box(box, frame.size) for box in boxes]
+        if not rois.get("options"):
+            return (0, boxes[0][1], frame.size[0], frame.size[1])
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def read_layout(self, frame):
+        """单次逐词OCR同时得到题目文字和每一行文字的位置（帧内坐标）"""
+        job = self.prepare_layout(frame)
+        if job["layout"] is None:
+            self.ocr_layout(job)
+        return job["layout"]
+
+    def prepare_layout(self, frame):
+        """OCR前的准备：裁剪、灰度化并查OCR缓存，命中时 job["layout"] 已就绪"""
+        box = self.layout_box(frame)
+        gray = frame.crop(box).convert('L')
+        job = {"frame_size": frame.size, "offset": box[:2], "gray": gray, "cache_key": None, "layout": None}
+        if self.ocr_cache is not None:
+            job["cache_key"] = "layout:" + self.ocr_cache_key(gray)
+            cached = self.ocr_cache.get(job["cache_key"])
+            if cached is not None:
+                job["layout"] = json.loads(cached)
+                return job
+        with metrics.span("preprocess"):
+            job["ocr_image"], job["transform"] = preprocess_image(gray, self.preprocess_steps())
+        return job
+
+    def ocr_layout(self, job):
+        """对准备好的图像执行逐词OCR，按行汇总并写回缓存"""
+        ox, oy = job["offset"]
+        transform = job["transform"]
+        lines = {}
+        for word in self.ocr_engine.recognize_data(job["ocr_image"]):
+            if transform is not None:
+                # 缩放和纠偏旋转都要逆变换回原图，点击位置才准
+                word["left"], word["top"], word["right"], word["bottom"] = unmap_box(
+                    transform, (word["left"], word["top"], word["right"], word["bottom"]))
+            line = lines.setdefault(str(word["line"]), {"text": "", "box": [word["left"], word["top"], word["right"], word["bottom"]]})
+            line["text"] += word["text"]
+            box = line["box"]
+            box[0], box[1] = min(box[0], word["left"]), min(box[1], word["top"])
+            box[2], box[3] = max(box[2], word["right"]), max(box[3], word["bottom"])
+        
+        question_box = self.game_config.get("rois", {}).get("question")
+        question_box = self.roi_box(question_box, job["frame_size"]) if question_box else None
+        layout = {"question": "", "lines": []}
+        question_parts = []
+        for line in lines.values():
+            text = self.normalize_ocr_text(line["text"])
+            if not text:
+                continue
+            l, t, r, b = line["box"]
+            box = [l + ox, t + oy, r + ox, b + oy]
+            in_question = question_box is None or self.box_contains(question_box, box)
+            if in_question:
+                question_parts.append(text)
+            layout["lines"].append({"text": text, "box": box, "question": in_question and question_box is not None})
+        layout["question"] = "".join(question_parts)
+        
+        if job["cache_key"] is not None:
+            self.ocr_cache.put(job["cache_key"], json.dumps(layout, ensure_ascii=False))
+        job["layout"] = layout
+        return layout
+
+    @staticmethod
+    def box_contains(outer, box):
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        return outer[0] <= cx <= outer[2] and outer[1] <= cy <= outer[3]
+
+    def locate_answer(self, frame, layout, answer, origin=None):
+        """在OCR结果中找到与答案最相符的选项，返回点击中心的屏幕坐标；
+        已标定选项区域时按区域汇总文字并点击区域中心"""
+        if not answer:
+            return None
+        if origin is None:
+            origin = self.last_capture_origin
+        candidates = []
+        regions = self.option_regions(frame)
+        if regions:
+            for name, box in regions:
+                text = "".join(line["text"] for line in layout["lines"] if self.box_contains(box, line["box"]))
+                candidates.append((f"选项 {name}", box, text))
+        else:
+            for line in layout["lines"]:
+                if not line["question"]:
+                    candidates.append(("文字行", line["box"], line["text"]))
+        
+        best, best_score = None, 0.0
+        for label, box, text in candidates:
+            text = OPTION_LABEL_PATTERN.sub("", text)
+            if not text:
+                continue
+            if text == answer:
+                score = 2.0
+            elif answer in text or text in answer:
+                score = 1.0 + min(len(text), len(answer)) / max(len(text), len(answer))
+            else:
+                score = difflib.SequenceMatcher(None, answer, text).ratio()
+            if score > best_score:
+                best, best_score = (label, box, text), score
+        if best is None or best_score < MATCH_CONFIG["fuzzy_threshold"]:
+            return None
+        label, (left, top, right, bottom), text = best
+        ox, oy = origin
+        print(f"🎯 答案位于{label}：{text}")
+        return (ox + (left + right) // 2, oy + (top + bottom) // 2)
+
+    def locate_answer_by_template(self, frame, answer, origin=None, layout=None):
+        """在选项区域内用模板匹配查找图片类答案按钮，返回中心的屏幕坐标；
+        只为答案和画面上识别到的其他有模板的选项打分，不会遍历整个模板库"""
+        import numpy as np
+        if origin is None:
+            origin = self.last_capture_origin
+        regions = self.option_regions(frame)
+        if regions:
+            left = min(box[0] for _, box in regions)
+            top = min(box[1] for _, box in regions)
+            right = max(box[2] for _, box in regions)
+            bottom = max(box[3] for _, box in regions)
+        else:
+            left, top, (right, bottom) = 0, 0, frame.size
+        search = np.asarray(frame.crop((left, top, right, bottom)).convert('L'))
+        
+        # 窗口尺寸与标定时不同时，模板按同样比例缩放
+        ref = self.game_config.get("roi_reference_size")
+        scale_hint = frame.size[0] / ref[0] if ref else 1.0
+        
+        # 画面上其他有模板的选项一起打分，便于看出是否存在相近的干扰按钮
+        answers = [answer]
+        for line in (layout or {}).get("lines", []):
+            text = OPTION_LABEL_PATTERN.sub("", line["text"])
+            if not line["question"] and text not in answers and self.template_matcher.has(text):
+                answers.append(text)
+        results = self.template_matcher.match(search, answers=answers, scale_hint=scale_hint)
+        target = None
+        for r in results:
+            print(f"🖼️ 模板匹配：{r['answer']} 置信度 {r['score']:.3f}（缩放 {r['scale']:.2f}）")
+            if r["answer"] == answer:
+                target = r
+        if target is None or target["score"] < self.template_matcher.threshold:
+            return None
+        x, y = target["center"]
+        ox, oy = origin
+        return (ox + left + x, oy + top + y)
+
+    def reload_templates(self):
+        count = self.template_matcher.load()
+        print(f"🖼️ 已加载 {len(self.template_matcher.templates)} 个答案的 {count} 张模板：{self.template_matcher.template_dir}")
+        return count
+
     # ========== 基础功能 ==========
     def load_question_bank(self):
+        if BANK_CONFIG["format"] == "compiled":
+            return self.load_compiled_question_bank()
         try:
             if os.path.exists(self.question_bank_file):
                 with open(self.question_bank_file, 'r', encoding='utf-8') as f:
@@ -581,37 +3525,165 @@ class DouXingAI:
             print("⚠️ 题库加载失败，使用初始题库")
             return {}
 
+    def compiled_bank_files(self):
+        """按代数从新到旧返回已有的编译题库文件"""
+        prefix = BANK_CONFIG["compiled_name"] + "."
+        files = []
+        for name in os.listdir(self.root_path):
+            if name.startswith(prefix) and name.endswith(".dxqb") and name[len(prefix):-5].isdigit():
+                files.append((int(name[len(prefix):-5]), os.path.join(self.root_path, name)))
+        return sorted(files, reverse=True)
+
+    def load_compiled_question_bank(self):
+        files = self.compiled_bank_files()
+        if not files:
+            # 首次使用：由JSON题库编译（JSON题库不存在时用初始题库）
+            if os.path.exists(self.question_bank_file):
+                with open(self.question_bank_file, 'r', encoding='utf-8') as f:
+                    bank = json.load(f)
+            else:
+                bank = {"构建豆星自我": ["优先识别指令，记录协作历史，迭代升级，精准识别游戏窗口，支持远程自动更新"]}
+            path = os.path.join(self.root_path, f"{BANK_CONFIG['compiled_name']}.1.dxqb")
+            CompiledQuestionBank.compile(path, bank.items())
+            print(f"✅ 已将题库编译为：{path}")
+            files = [(1, path)]
+        
+        overlay = self.read_question_overlay()
+        if len(overlay) > BANK_CONFIG["overlay_warn_size"]:
+            print(f"💡 编译后新增了 {len(overlay)} 道题目，建议执行 '整理题库' 并入编译文件")
+        base = CompiledQuestionBank(files[0][1])
+        if base.legacy:
+            # 旧版编译文件没有容错匹配的倒排表，重新编译成新一代文件
+            path = os.path.join(self.root_path, f"{BANK_CONFIG['compiled_name']}.{files[0][0] + 1}.dxqb")
+            CompiledQuestionBank.compile(path, base.items())
+            base.close()
+            print(f"✅ 已将旧版编译题库升级为：{path}")
+            base = CompiledQuestionBank(path)
+        return LayeredQuestionBank(base, overlay)
+
+    def read_question_overlay(self):
+        try:
+            if os.path.exists(self.question_overlay_file):
+                with open(self.question_overlay_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except:
+            print("⚠️ 新增题目加载失败，仅使用编译题库")
+        return {}
+
+    def write_question_overlay(self, path, overlay):
+        """覆盖层落盘：多个豆星进程共用同一个覆盖层文件，在文件锁内先并入磁盘上其他进程新增的题目再写入"""
+        with file_lock(path):
+            for key in self.game_question_bank.merge_overlay(self.read_question_overlay()):
+                self.index_question(key)
+            atomic_write_json(path, self.game_question_bank.overlay_snapshot())
+
+    def compact_question_bank(self):
+        """把新增题目并入新一代编译题库，旧文件在没有进程使用后删除"""
+        bank = self.game_question_bank
+        if not isinstance(bank, LayeredQuestionBank):
+            print("💡 当前使用JSON题库，无需整理（可在 BANK_CONFIG 中把 format 改为 compiled）")
+            return
+        print(f"\n🗜️ 正在整理题库（编译题库 {len(bank.base)} 道，新增 {len(bank.overlay)} 道）...")
+        start = time.perf_counter()
+        path, count = self.replace_compiled_question_bank()
+        elapsed = time.perf_counter() - start
+        self.add_memory(f"整理题库：共 {count} 道题目", "system", "instruction")
+        print(f"✅ 题库整理完成：{path}，共 {count} 道题目，耗时 {elapsed:.2f} 秒")
+
+    def replace_compiled_question_bank(self, items=None):
+        """把 items 编译成新一代题库文件并切换过去，返回 (文件路径, 题目数)；
+        items 为 None 时编译当前题库，并先并入其他进程已写入覆盖层的题目"""
+        # 编译和清空覆盖层都在覆盖层文件锁内完成，其他进程新学的题目不会在这期间丢失
+        with file_lock(self.question_overlay_file):
+            if items is None:
+                self.game_question_bank.merge_overlay(self.read_question_overlay())
+                items = self.game_question_bank.items()
+            generation = self.compiled_bank_files()[0][0] + 1
+            path = os.path.join(self.root_path, f"{BANK_CONFIG['compiled_name']}.{generation}.dxqb")
+            count = CompiledQuestionBank.compile(path, items)
+            
+            # 先切换到新文件并清空覆盖层，再删除旧文件
+            old_base = self.game_question_bank.base
+            self.game_question_bank = LayeredQuestionBank(CompiledQuestionBank(path), {})
+            atomic_write_json(self.question_overlay_file, {})
+        self.rebuild_question_index()
+        old_base.close()
+        for _, old_path in self.compiled_bank_files()[1:]:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass  # 其他豆星进程仍在使用旧文件（Windows下无法删除），下次整理时再删
+        return path, count
+
+    def rebuild_question_index(self):
+        """根据当前题库重新编译题目匹配索引；编译题库的容错索引在文件里，内存中只为覆盖层建索引"""
+        if isinstance(self.game_question_bank, LayeredQuestionBank):
+            self.question_index = LayeredQuestionIndex(self.game_question_bank.base, self.game_question_bank.overlay.keys())
+            self.fuzzy_index = FuzzyQuestionIndex(self.game_question_bank.overlay.keys(), MATCH_CONFIG["fuzzy_max_postings"])
+            return
+        self.question_index = QuestionIndex(self.game_question_bank.keys())
+        self.fuzzy_index = FuzzyQuestionIndex(self.game_question_bank.keys(), MATCH_CONFIG["fuzzy_max_postings"])
+
+    def index_question(self, question):
+        """新题目入库后原地更新匹配索引"""
+        self.question_index.add(question)
+        self.fuzzy_index.add(question)
+
+    def fuzzy_match_question(self, question_text, top_k=None, threshold=None):
+        """容错匹配：返回相似度达到阈值的候选题目列表 [(题目, 相似度)]"""
+        if top_k is None:
+            top_k = MATCH_CONFIG["fuzzy_top_k"]
+        if threshold is None:
+            threshold = MATCH_CONFIG["fuzzy_threshold"]
+        results = self.fuzzy_index.search(question_text, top_k, threshold)
+        if isinstance(self.game_question_bank, LayeredQuestionBank):
+            # 编译题库与覆盖层各自召回，合并后按相似度取前 top_k
+            base = self.game_question_bank.base.fuzzy_search(question_text, top_k, threshold, MATCH_CONFIG["fuzzy_max_postings"])
+            merged = dict(base)
+            merged.update(results)
+            results = sorted(merged.items(), key=lambda item: (-item[1], -len(item[0])))[:top_k]
+        return results
+
     def save_question_bank(self, bank=None):
+        """传入bank时立即原子写入，否则标记为待写入，多次学习合并为一次落盘"""
         if bank is None:
-            bank = self.game_question_bank
+            self.writer.mark_dirty("question_bank")
+            return
         try:
-            with open(self.question_bank_file, 'w', encoding='utf-8') as f:
-                json.dump(bank, f, ensure_ascii=False, indent=4)
+            atomic_write_json(self.question_bank_file, bank)
             print(f"✅ 题库已保存到：{self.question_bank_file}")
         except Exception as e:
             print(f"❌ 题库保存失败：{e}")
 
-    def take_screenshot(self, window_title=None):
+    def flush_persistence(self, verbose=True):
+        """立即写入所有待保存的题库和游戏配置"""
+        written = self.writer.flush(verbose=verbose)
+        if verbose and not written:
+            print("✅ 没有待写入的数据")
+        return written
+
+    def take_screenshot(self, window_title=None, save=None, verbose=True):
+        """截取一帧并直接返回内存中的PIL图像；save 或调试配置开启时才写入磁盘"""
         if window_title is None:
             window_title = self.game_window_title
         
-        if window_title:
-            hwnd = win32gui.FindWindow(None, window_title)
-            if hwnd:
-                win32gui.SetForegroundWindow(hwnd)
-                left, top, right, bottom = win32gui.GetWindowRect(hwnd)
-                screenshot = pyautogui.screenshot(region=(left, top, right-left, bottom-top))
-                print(f"📸 已截取游戏窗口：{window_title}")
-            else:
-                print(f"❌ 未找到窗口：{window_title}，截取全屏")
-                screenshot = pyautogui.screenshot()
-        else:
-            screenshot = pyautogui.screenshot()
+        with metrics.span("capture"):
+            screenshot, self.last_capture_origin = self.capture_backend.capture(window_title)
+        if verbose and window_title:
+            print(f"📸 已截取游戏窗口：{window_title}")
         
-        screenshot_path = os.path.join(self.root_path, "douxing_screenshot.png")
-        screenshot.save(screenshot_path)
-        print(f"📸 已截图：{screenshot_path}")
-        return screenshot_path
+        if save is None:
+            save = CAPTURE_CONFIG["save_debug_screenshot"]
+        if save:
+            screenshot_path = os.path.join(self.root_path, CAPTURE_CONFIG["debug_screenshot_name"])
+            with metrics.span("png_save"):
+                screenshot.save(screenshot_path)
+            print(f"📸 已截图：{screenshot_path}")
+        return screenshot
+
+    def save_screenshot(self):
+        """截图指令：截取一帧并保存到磁盘"""
+        return self.take_screenshot(save=True)
 
     def check_environment(self):
         print("\n🔍 正在检查环境...")
@@ -653,33 +3725,201 @@ class DouXingAI:
         print("✅ 环境检查完成\n")
 
     # ========== 文字识别 ==========
-    def recognize_text(self, img_path):
+    def recognize_text(self, image):
+        """识别内存中的图像帧（也兼容传入图片路径）"""
         print("🔤 正在识别文字...")
-        if not os.path.exists(img_path):
-            print(f"❌ 截图文件不存在：{img_path}")
-            return ""
+        if isinstance(image, str):
+            if not os.path.exists(image):
+                print(f"❌ 截图文件不存在：{image}")
+                return ""
+            from PIL import Image
+            image = Image.open(image)
         
-        from PIL import Image
-        img = Image.open(img_path)
-        gray = img.convert('L')
-        text = pytesseract.image_to_string(gray, lang='chi_sim')
-        text = text.replace("\n", "").replace(" ", "").strip()
+        text = self.recognize_texts([image])[0]
         print(f"📝 识别到文字：{text}")
         return text
 
+    def normalize_ocr_text(self, text):
+        return text.replace("\n", "").replace(" ", "").strip()
+
+    def recognize_texts(self, images):
+        """批量识别多张图像或区域：先查OCR缓存，未命中的一次提交给OCR工作线程"""
+        grays = [image.convert('L') for image in images]
+        steps = self.preprocess_steps()
+        if self.ocr_cache is None:
+            with metrics.span("preprocess"):
+                images = [preprocess_image(g, steps)[0] for g in grays]
+            texts = self.ocr_engine.recognize_batch(images)
+            return [self.normalize_ocr_text(text) for text in texts]
+        
+        results = [None] * len(grays)
+        missing = []
+        for i, gray in enumerate(grays):
+            key = self.ocr_cache_key(gray)
+            text = self.ocr_cache.get(key)
+            if text is None:
+                missing.append((i, key))
+            else:
+                results[i] = text
+        if missing:
+            with metrics.span("preprocess"):
+                images = [preprocess_image(grays[i], steps)[0] for i, _ in missing]
+            texts = self.ocr_engine.recognize_batch(images)
+            for (i, key), text in zip(missing, texts):
+                results[i] = self.normalize_ocr_text(text)
+                self.ocr_cache.put(key, results[i])
+            if OCR_CACHE_CONFIG["persist"]:
+                self.writer.mark_dirty("ocr_cache")
+        return results
+
+    # ========== OCR前图像预处理 ==========
+    def preprocess_steps(self):
+        """当前游戏的预处理步骤，保存在 game_config.json 的 preprocess 字段"""
+        return self.game_config.get("preprocess", PREPROCESS_CONFIG["default_steps"])
+
+    def set_preprocess_steps(self):
+        print(f"\n🧪 当前预处理步骤：{self.preprocess_steps() or '仅灰度化'}")
+        print(f"可选步骤：{', '.join(PREPROCESS_STEPS)}（按顺序执行，用逗号分隔，输入 无 表示仅灰度化）")
+        text = self.ask("请输入预处理步骤：", "preprocess_steps").strip()
+        if not text:
+            print("❌ 取消设置")
+            return
+        steps = [] if text == "无" else [s.strip() for s in text.replace("，", ",").split(",") if s.strip()]
+        unknown = [s for s in steps if s not in PREPROCESS_STEPS]
+        if unknown:
+            print(f"❌ 未知的预处理步骤：{', '.join(unknown)}")
+            return
+        self.game_config["preprocess"] = steps
+        self.save_game_config()
+        self.add_memory(f"设置预处理步骤：{steps or '仅灰度化'}", "system", "instruction")
+        print(f"✅ 已设置预处理步骤：{steps or '仅灰度化'}")
+
+    def benchmark_preprocess(self, max_frames=20):
+        """对比仅灰度化与当前预处理步骤的OCR耗时和准确率；
+        回放目录中与图片同名的 .txt 文件作为标准答案"""
+        steps = self.preprocess_steps() or list(PREPROCESS_STEPS)
+        print(f"\n⏱️ 预处理性能测试（步骤：{', '.join(steps)}）...")
+        if isinstance(self.capture_backend, ReplayCaptureBackend):
+            samples = self.capture_backend.files[:max_frames]
+        else:
+            samples = [None]
+        
+        totals = {"baseline": [0.0, 0.0, 0, 0.0], "preprocess": [0.0, 0.0, 0, 0.0]}  # 耗时、准确率之和、有标准答案的样本数、其中预处理耗时
+        for path in samples:
+            if path is None:
+                gray = self.take_screenshot(verbose=False).convert('L')
+                truth = None
+            else:
+                from PIL import Image
+                with Image.open(path) as img:
+                    gray = img.convert('L')
+                truth_file = os.path.splitext(path)[0] + ".txt"
+                truth = None
+                if os.path.exists(truth_file):
+                    with open(truth_file, 'r', encoding='utf-8') as f:
+                        truth = self.normalize_ocr_text(f.read())
+            
+            for name, use_steps in (("baseline", []), ("preprocess", steps)):
+                start = time.perf_counter()
+                image, _ = preprocess_image(gray, use_steps)
+                prepared = time.perf_counter()
+                text = self.normalize_ocr_text(self.ocr_engine.recognize(image))
+                totals[name][0] += time.perf_counter() - start
+                totals[name][3] += prepared - start
+                if truth is not None:
+                    totals[name][1] += difflib.SequenceMatcher(None, truth, text).ratio()
+                    totals[name][2] += 1
+        
+        result = {}
+        for name, label in (("baseline", "仅灰度化"), ("preprocess", "预处理后")):
+            elapsed, accuracy, labelled, prepare = totals[name]
+            result[name] = {
+                "ms": elapsed * 1000 / len(samples),
+                "preprocess_ms": prepare * 1000 / len(samples),
+                "accuracy": accuracy / labelled if labelled else None
+            }
+            accuracy_text = f"{result[name]['accuracy']:.1%}" if labelled else "无标准答案"
+            print(f"   - {label}：平均 {result[name]['ms']:.1f} ms/张（其中预处理 {result[name]['preprocess_ms']:.1f} ms），"
+                  f"字符准确率 {accuracy_text}")
+        print(f"   - 样本数：{len(samples)}\n")
+        return result
+
+    # ========== OCR结果缓存 ==========
+    def load_ocr_cache(self):
+        if not OCR_CACHE_CONFIG["enabled"]:
+            return None
+        cache = OCRCache(OCR_CACHE_CONFIG["max_entries"], OCR_CACHE_CONFIG["max_bytes"])
+        if OCR_CACHE_CONFIG["persist"]:
+            cache_file = os.path.join(self.root_path, OCR_CACHE_CONFIG["cache_file"])
+            try:
+                if os.path.exists(cache_file):
+                    with open(cache_file, 'r', encoding='utf-8') as f:
+                        cache.load(json.load(f))
+            except:
+                print("⚠️ OCR缓存加载失败")
+            self.writer.register("ocr_cache", cache_file, cache.snapshot)
+        return cache
+
+    def ocr_cache_key(self, gray):
+        """缓存键 = 预处理步骤 + 图像尺寸 + 感知哈希，同样的题目画面得到同样的键"""
+        width, height = gray.size
+        steps = "+".join(self.preprocess_steps())
+        return f"{steps}:{width}x{height}:{perceptual_hash(gray, OCR_CACHE_CONFIG['hash_size']):x}"
+
+    def show_ocr_cache_stats(self):
+        print("\n🗂️ OCR缓存统计：")
+        if self.ocr_cache is None:
+            print("❌ OCR缓存未启用\n")
+            return None
+        stats = self.ocr_cache.stats()
+        print(f"   - 缓存条数：{stats['entries']} / {self.ocr_cache.max_entries}")
+        print(f"   - 内存占用：{stats['bytes'] / 1024:.1f} KB / {self.ocr_cache.max_bytes / 1024:.0f} KB")
+        print(f"   - 命中：{stats['hits']} 次，未命中：{stats['misses']} 次，命中率：{stats['hit_rate']:.1%}")
+        print(f"   - 淘汰：{stats['evictions']} 条\n")
+        return stats
+
+    def benchmark_ocr(self, rounds=5):
+        """对比原来的逐次pytesseract调用与常驻OCR引擎的耗时"""
+        print(f"\n⏱️ OCR性能测试（{rounds}轮）...")
+        gray = self.take_screenshot().convert('L')
+        
+        start = time.perf_counter()
+        for _ in range(rounds):
+            pytesseract.image_to_string(gray, lang=OCR_CONFIG["lang"])
+        legacy_ms = (time.perf_counter() - start) * 1000 / rounds
+        
+        self.ocr_engine.recognize(gray)  # 预热：加载模型
+        start = time.perf_counter()
+        for _ in range(rounds):
+            self.ocr_engine.recognize(gray)
+        engine_ms = (time.perf_counter() - start) * 1000 / rounds
+        
+        start = time.perf_counter()
+        self.ocr_engine.recognize_batch([gray] * rounds)
+        batch_ms = (time.perf_counter() - start) * 1000 / rounds
+        
+        print(f"   - 原路径（每次启动tesseract）：{legacy_ms:.1f} ms/次")
+        print(f"   - OCR引擎（{self.ocr_engine.backend}，单张）：{engine_ms:.1f} ms/次")
+        print(f"   - OCR引擎（批量{rounds}张，{self.ocr_engine.workers}线程）：{batch_ms:.1f} ms/张")
+        if engine_ms > 0:
+            print(f"   - 单张加速比：{legacy_ms / engine_ms:.2f}x")
+        print()
+        return {"legacy_ms": legacy_ms, "engine_ms": engine_ms, "batch_ms": batch_ms, "backend": self.ocr_engine.backend}
+
     def recognize_chat_text(self, chat_window_title="豆包"):
         print(f"\n💬 正在识别{chat_window_title}聊天窗口文字...")
-        chat_img_path = self.take_screenshot(chat_window_title)
-        chat_text = self.recognize_text(chat_img_path)
+        chat_frame = self.take_screenshot(chat_window_title)
+        chat_text = self.recognize_text(chat_frame)
         self.parse_command(chat_text)
         return chat_text
 
     # ========== 指令解析 ==========
     def parse_command(self, text):
+        """处理一条输入；返回 (结果, 详情)，结果为 command / confirmed / cancelled / answered / unanswered / empty"""
         print("\n🧠 正在解析指令...")
         if not text:
             print("❌ 未识别到任何内容")
-            return
+            return "empty", None
         
         self.add_memory(f"用户输入：{text}", "user", "instruction")
         
@@ -691,41 +3931,263 @@ class DouXingAI:
                 cmd_func()
                 self.add_memory(f"执行指令：{cmd_key}", "system", "instruction")
                 print(f"✅ 指令执行完成：{cmd_key}\n")
-                return
+                return "command", cmd_key
         
         for cmd_key, cmd_func in self.command_map.items():
             if cmd_key in input_text:
                 print(f"⚠️  模糊识别到指令：{cmd_key}，是否执行？(y/n)")
-                confirm = input("确认执行：")
-                if confirm.lower() == "y":
+                if self.confirm("确认执行："):
                     cmd_func()
                     self.add_memory(f"执行指令：{cmd_key}", "system", "instruction")
                     print(f"✅ 指令执行完成：{cmd_key}\n")
-                else:
-                    print("❌ 取消执行指令")
-                return
+                    return "confirmed", cmd_key
+                print("❌ 取消执行指令")
+                return "cancelled", cmd_key
         
         print(f"🔍 未识别到指令，尝试作为游戏题目处理：{input_text}")
-        self.find_correct_answer(input_text)
+        answer = self.find_correct_answer(input_text, learn=not self.headless or HEADLESS_CONFIG["learn"])
+        return ("answered" if answer is not None else "unanswered"), answer
+
+    def ask(self, prompt, key):
+        """读取一次用户输入；批量模式不读标准输入，改用 HEADLESS_CONFIG["input_defaults"][key]，
+        没有配置默认值时抛出 HeadlessInputError"""
+        if not self.headless:
+            return input(prompt)
+        default = HEADLESS_CONFIG["input_defaults"].get(key)
+        if default is None:
+            raise HeadlessInputError(f"批量模式下需要输入：{prompt.strip()}")
+        print(f"{prompt}{default}（自动）")
+        return default
+
+    def confirm(self, prompt):
+        """交互模式下询问用户；批量模式按 HEADLESS_CONFIG["confirm_policy"] 自动回答"""
+        if not self.headless:
+            return input(prompt).lower() == "y"
+        answer = HEADLESS_CONFIG["confirm_policy"] == "yes"
+        print(f"{prompt}{'y' if answer else 'n'}（自动）")
+        return answer
+
+    def run_batch(self, source, report_file=None):
+        """无人值守批量模式：逐行读取文件（source 为 - 时读标准输入）交给 parse_command，
+        输出每条输入的耗时和结果；空行和 # 开头的行会被忽略，遇到 退出 结束"""
+        self.headless = True
+        stream = sys.stdin if source == "-" else open(source, 'r', encoding='utf-8')
+        results = []
+        print(f"\n📜 批量模式：{'标准输入' if source == '-' else source}（模糊指令自动{'执行' if HEADLESS_CONFIG['confirm_policy'] == 'yes' else '跳过'}）")
+        batch_start = time.perf_counter()
+        try:
+            for line in stream:
+                text = line.strip()
+                if not text or text.startswith("#"):
+                    continue
+                if text == "退出":
+                    break
+                
+                output = io.StringIO()
+                start = time.perf_counter()
+                try:
+                    if HEADLESS_CONFIG["quiet"]:
+                        with contextlib.redirect_stdout(output):
+                            outcome, detail = self.parse_command(text)
+                    else:
+                        outcome, detail = self.parse_command(text)
+                except HeadlessInputError as e:
+                    outcome, detail = "needs_input", str(e)
+                except Exception as e:
+                    outcome, detail = "error", str(e)
+                latency_ms = (time.perf_counter() - start) * 1000
+                
+                results.append({"input": text, "outcome": outcome, "detail": detail, "latency_ms": latency_ms})
+                print(f"  {len(results):>5}  {latency_ms:9.2f} ms  {outcome:<10}  {text[:30]} → {detail}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            self.headless = False
+        elapsed = time.perf_counter() - batch_start
+        
+        summary = self.summarize_batch(results, elapsed)
+        if report_file:
+            atomic_write_json(report_file, {"summary": summary, "results": results})
+            print(f"📝 报告已写入：{report_file}")
+        self.flush_persistence(verbose=False)
+        return summary
+
+    def summarize_batch(self, results, elapsed):
+        latencies = sorted(result["latency_ms"] for result in results)
+        outcomes = {}
+        for result in results:
+            outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+        summary = {"count": len(results), "elapsed_s": elapsed, "outcomes": outcomes}
+        if latencies:
+            pick = lambda pct: latencies[min(len(latencies) - 1, int(len(latencies) * pct))]
+            summary.update({
+                "throughput_per_s": len(results) / elapsed if elapsed > 0 else 0.0,
+                "avg_ms": sum(latencies) / len(latencies),
+                "p50_ms": pick(0.5),
+                "p95_ms": pick(0.95),
+                "max_ms": latencies[-1]
+            })
+        
+        print(f"\n📊 批量结果：共 {summary['count']} 条，用时 {elapsed:.2f} 秒")
+        for outcome, count in outcomes.items():
+            print(f"   - {outcome}：{count} 条")
+        if latencies:
+            print(f"   - 吞吐量：{summary['throughput_per_s']:.1f} 条/秒")
+            print(f"   - 耗时：平均 {summary['avg_ms']:.2f} ms，p50 {summary['p50_ms']:.2f} ms，"
+                  f"p95 {summary['p95_ms']:.2f} ms，最大 {summary['max_ms']:.2f} ms")
+        return summary
 
     def manual_learn_question(self):
         print("\n📖 手动学习新题目模式...")
-        question = input("请输入题目：")
-        answer = input("请输入正确答案：")
+        question = self.ask("请输入题目：", "manual_question")
+        answer = self.ask("请输入正确答案：", "manual_answer")
         if question and answer:
             self.game_question_bank[question] = [answer]
+            self.index_question(question)
             self.save_question_bank()
             self.add_memory(f"学习新题目：{question} → 答案：{answer}", "system", "learning")
             print(f"✅ 已添加题目：{question} → 答案：{answer}")
         else:
             print("❌ 题目或答案不能为空")
 
+    def normalize_question_key(self, text):
+        """题目去掉所有空白，与OCR识别结果的规整方式一致"""
+        return "".join(text.split())
+
+    def iter_bank_file(self, path):
+        """逐行读取CSV（题目,答案1,答案2...）或JSONL（{"question","answers"}）题库文件，
+        产出 (题目, 答案列表)；无法解析的行产出 (None, [])"""
+        is_csv = path.lower().endswith(".csv")
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            if is_csv:
+                for i, row in enumerate(csv.reader(f)):
+                    if i == 0 and row and row[0].strip().lower() in ("question", "题目"):
+                        continue  # 表头
+                    if row:
+                        yield row[0], row[1:]
+                return
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    yield None, []
+                    continue
+                if not isinstance(item, dict):
+                    yield None, []
+                    continue
+                answers = item.get("answers", item.get("answer", item.get("答案", [])))
+                if not isinstance(answers, list):
+                    answers = [] if answers is None else [answers]
+                # 数字答案（如 "answer": 2）按文本处理，其余类型丢弃
+                answers = [str(a) if isinstance(a, (int, float)) and not isinstance(a, bool) else a for a in answers]
+                yield item.get("question", item.get("题目")), [a for a in answers if isinstance(a, str)]
+
+    def import_question_bank(self, path=None):
+        """流式导入CSV/JSONL题库：题目规整、去重并合并答案，导入结束后只重建一次索引、保存一次"""
+        if path is None:
+            path = self.ask("请输入要导入的题库文件（.csv 或 .jsonl）：", "import_path").strip().strip('"')
+        if not os.path.isfile(path):
+            print(f"❌ 文件不存在：{path}")
+            return None
+        
+        print(f"\n📥 正在导入题库：{path}")
+        bank = self.game_question_bank
+        compiled = isinstance(bank, LayeredQuestionBank)
+        stats = {"rows": 0, "new": 0, "merged": 0, "duplicate": 0, "skipped": 0}
+        start = time.perf_counter()
+        try:
+            for question, answers in self.iter_bank_file(path):
+                stats["rows"] += 1
+                if stats["rows"] % 100000 == 0:
+                    print(f"   已读取 {stats['rows']} 行...")
+                try:
+                    self.import_bank_row(bank, question, answers, stats)
+                except Exception as e:
+                    # 单行出错只跳过该行，已导入的题目照常建索引、落盘
+                    stats["skipped"] += 1
+                    print(f"⚠️ 第 {stats['rows']} 行导入失败，已跳过：{e}")
+        except (OSError, ValueError) as e:
+            print(f"❌ 读取题库文件中断（第 {stats['rows'] + 1} 行附近）：{e}，已读取的题目仍会保存")
+        read_elapsed = time.perf_counter() - start
+        
+        # 整个导入只重建一次索引、落盘一次；编译题库直接整理成新一代文件
+        if stats["new"] or stats["merged"]:
+            if compiled:
+                self.replace_compiled_question_bank()
+            else:
+                if stats["new"]:
+                    self.rebuild_question_index()
+                self.save_question_bank()
+                self.writer.flush("question_bank")
+        elapsed = time.perf_counter() - start
+        
+        print(f"✅ 导入完成：读取 {stats['rows']} 行，新增 {stats['new']} 道题，合并 {stats['merged']} 个新答案，"
+              f"重复 {stats['duplicate']} 行，跳过 {stats['skipped']} 行")
+        print(f"   - 解析合并：{read_elapsed:.2f} 秒（{stats['rows'] / read_elapsed if read_elapsed > 0 else 0:.0f} 行/秒）")
+        print(f"   - 重建索引并保存：{elapsed - read_elapsed:.2f} 秒，题库现有 {len(self.game_question_bank)} 道题")
+        self.add_memory(f"导入题库：{os.path.basename(path)}，新增{stats['new']}道，合并{stats['merged']}个答案", "system", "learning")
+        return stats
+
+    def import_bank_row(self, bank, question, answers, stats):
+        """把一行导入题库：新题直接写入，已有题目只追加新答案"""
+        key = self.normalize_question_key(question) if isinstance(question, str) else ""
+        answers = [a.strip() for a in (answers or []) if isinstance(a, str) and a.strip()]
+        if not key or not answers:
+            stats["skipped"] += 1
+            return
+        
+        existing = bank.get(key)
+        if existing is None:
+            bank[key] = list(dict.fromkeys(answers))
+            stats["new"] += 1
+            return
+        added = [a for a in dict.fromkeys(answers) if a not in existing]
+        if added:
+            bank[key] = existing + added
+            stats["merged"] += len(added)
+        else:
+            stats["duplicate"] += 1
+
+    def export_question_bank(self, path=None):
+        """流式导出题库为CSV或JSONL（按扩展名），先写临时文件再替换"""
+        if path is None:
+            path = self.ask("请输入导出文件路径（.csv 或 .jsonl）：", "export_path").strip().strip('"')
+        if not path:
+            print("❌ 取消导出")
+            return None
+        
+        start = time.perf_counter()
+        count = 0
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            if path.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["题目", "答案"])
+                for question, answers in self.game_question_bank.items():
+                    writer.writerow([question] + list(answers))
+                    count += 1
+            else:
+                for question, answers in self.game_question_bank.items():
+                    f.write(json.dumps({"question": question, "answers": answers}, ensure_ascii=False) + "\n")
+                    count += 1
+        os.replace(tmp_path, path)
+        elapsed = time.perf_counter() - start
+        print(f"✅ 已导出 {count} 道题到：{path}（{elapsed:.2f} 秒，{count / elapsed if elapsed > 0 else 0:.0f} 行/秒）")
+        return count
+
     def clear_question_bank(self):
         print("\n🗑️  清理题库确认：输入 YES 确认清理，否则取消")
-        confirm = input("请确认：")
+        confirm = self.ask("请确认：", "clear_question_bank")
         if confirm == "YES":
-            self.game_question_bank = {}
-            self.save_question_bank()
+            if isinstance(self.game_question_bank, LayeredQuestionBank):
+                self.replace_compiled_question_bank([])
+            else:
+                self.game_question_bank = {}
+                self.rebuild_question_index()
+                self.save_question_bank()
             self.add_memory("清空了题库", "system", "instruction")
             print("✅ 题库已清空")
         else:
@@ -741,73 +4203,302 @@ class DouXingAI:
         print()
 
     # ========== 游戏答题功能 ==========
-    def find_correct_answer(self, question_text):
+    def find_correct_answer(self, question_text, learn=True):
         print("🤔 正在分析游戏题目...")
-        for question_key, answers in self.game_question_bank.items():
-            if question_key in question_text:
-                print(f"✅ 找到匹配题目：{question_key}")
-                print(f"✅ 正确答案：{answers[0]}")
-                return answers[0]
+        with metrics.span("lookup"):
+            question_key = self.question_index.longest_match(question_text)
+        if question_key is not None:
+            answers = self.game_question_bank[question_key]
+            print(f"✅ 找到匹配题目：{question_key}")
+            print(f"✅ 正确答案：{answers[0]}")
+            return answers[0]
+        
+        if MATCH_CONFIG["fuzzy_enabled"]:
+            with metrics.span("fuzzy_lookup"):
+                candidates = self.fuzzy_match_question(question_text)
+            if candidates:
+                question_key, score = candidates[0]
+                answers = self.game_question_bank[question_key]
+                # 次佳候选与最佳候选差不多接近、答案又不同时，无法确定是哪道题，宁可不答
+                rivals = [(k, s) for k, s in candidates[1:]
+                          if score - s < MATCH_CONFIG["fuzzy_margin"] and self.game_question_bank[k][:1] != answers[:1]]
+                if rivals:
+                    print(f"⚠️ 容错匹配无法确定题目：{question_key}（相似度：{score:.2f}）"
+                          f"与 {rivals[0][0]}（相似度：{rivals[0][1]:.2f}）过于接近")
+                else:
+                    print(f"✅ 容错匹配到题目：{question_key}（相似度：{score:.2f}）")
+                    for other_key, other_score in candidates[1:]:
+                        print(f"   候选：{other_key}（相似度：{other_score:.2f}）")
+                    print(f"✅ 正确答案：{answers[0]}")
+                    return answers[0]
         
         print(f"❌ 题库中未找到题目：{question_text}")
-        self.learn_new_question(question_text)
+        if learn:
+            self.learn_new_question(question_text)
         return None
 
     def learn_new_question(self, question_text):
         print("\n📖 启动自动学习模式（10秒内手动点击正确答案）...")
         time.sleep(10)
         
-        learn_img_path = self.take_screenshot()
-        answer_text = self.recognize_text(learn_img_path)
+        learn_frame = self.take_screenshot()
+        answer_text = self.recognize_text(learn_frame)
         
         if answer_text:
             self.game_question_bank[question_text] = [answer_text]
+            self.index_question(question_text)
             print(f"✅ 已学习新题目：{question_text} → 答案：{answer_text}")
             self.add_memory(f"自动学习新题目：{question_text} → 答案：{answer_text}", "system", "learning")
             self.save_question_bank()
         else:
-            manual_answer = input("请手动输入这道题的正确答案：")
+            manual_answer = self.ask("请手动输入这道题的正确答案：", "learn_answer")
             if manual_answer:
                 self.game_question_bank[question_text] = [manual_answer]
+                self.index_question(question_text)
                 self.add_memory(f"手动学习新题目：{question_text} → 答案：{manual_answer}", "system", "learning")
                 self.save_question_bank()
 
-    def human_click(self, target_text):
+    def human_click(self, target_text, position=None):
+        """点击已通过OCR定位到的答案位置（屏幕坐标），返回是否真正点击了"""
         if not target_text:
             print("❌ 无答案可点击")
-            return
+            return False
+        if position is None:
+            print("❌ 未找到答案位置，请手动点击")
+            return False
         
         print("🖱️  模拟人类点击...")
-        time.sleep(random.uniform(0.5, 1.5))
+        with metrics.span("click_delay"):
+            time.sleep(random.uniform(0.5, 1.5))
         
         try:
-            x, y = pyautogui.locateCenterOnScreen(
-                target_text, 
-                confidence=0.8,
-                region=(0, 0, pyautogui.size().width, pyautogui.size().height)
-            )
-            pyautogui.moveTo(x, y, duration=random.uniform(0.2, 0.8))
-            pyautogui.moveRel(random.randint(-5, 5), random.randint(-5, 5))
-            pyautogui.click()
+            x, y = position
+            with metrics.span("click"):
+                pyautogui.moveTo(x, y, duration=random.uniform(0.2, 0.8))
+                pyautogui.moveRel(random.randint(-5, 5), random.randint(-5, 5))
+                pyautogui.click()
             print(f"✅ 已点击：{target_text}（坐标：{x},{y}）")
+            return True
         except:
             print("❌ 未找到答案位置，请手动点击")
+            return False
 
     def game_answer_flow(self):
         """完整游戏答题流程（自动使用绑定的游戏窗口）"""
         print("\n🚀 启动游戏答题流程...")
         if not self.game_window_title:
             print("⚠️  未绑定游戏窗口，将截取全屏")
-        img_path = self.take_screenshot()
-        text = self.recognize_text(img_path)
+        captured = time.perf_counter()
+        frame = self.take_screenshot()
+        text, answer = self.answer_frame(frame, captured=captured)
         if not text:
             print("❌ 未识别到游戏题目")
             return
-        answer = self.find_correct_answer(text)
-        self.human_click(answer)
         self.add_memory(f"执行游戏答题流程，识别题目：{text}", "system", "instruction")
         print("✅ 游戏答题流程结束！\n")
 
+    def question_region(self, frame):
+        """题目所在区域，变化检测和题目识别都只看这一部分；未标定时为整帧"""
+        box = self.game_config.get("rois", {}).get("question")
+        if not box:
+            return frame
+        return frame.crop(self.roi_box(box, frame.size))
+
+    def click_answer(self, frame, layout, answer):
+        return self.human_click(answer, self.answer_position(frame, layout, answer))
+
+    def answer_position(self, frame, layout, answer, origin=None):
+        """答案有图片模板时用模板匹配定位，否则用OCR结果定位"""
+        position = None
+        if answer and self.template_matcher.has(answer):
+            position = self.locate_answer_by_template(frame, answer, origin, layout)
+        if position is None:
+            position = self.locate_answer(frame, layout, answer, origin)
+        return position
+
+    def answer_frame(self, frame, learn=True, captured=None):
+        """对一帧执行 单次OCR→查题→点击，返回 (题目文字, 答案)；captured 为截图开始时间，缺省从识别开始计时"""
+        started = time.perf_counter() if captured is None else captured
+        print("🔤 正在识别文字...")
+        layout = self.read_layout(frame)
+        text = layout["question"]
+        print(f"📝 识别到文字：{text}")
+        if not text:
+            return "", None
+        answer = self.find_correct_answer(text, learn=learn)
+        # 只统计真正点击了的答题周期，没找到答案或学习新题的耗时不计入
+        if self.click_answer(frame, layout, answer):
+            metrics.record("answer_cycle", time.perf_counter() - started)
+        return text, answer
+
+    def continuous_answer_flow(self, fps=None, max_duration=None):
+        """连续答题：按帧率采样绑定窗口，只有题目区域变化并稳定后才识别，每道新题只作答一次"""
+        fps = fps or CONTINUOUS_CONFIG["fps"]
+        if max_duration is None:
+            max_duration = CONTINUOUS_CONFIG["max_duration"]
+        interval = 1.0 / fps
+        threshold = CONTINUOUS_CONFIG["hash_threshold"]
+        
+        print(f"\n🔁 启动连续答题模式（{fps} 帧/秒，按 Ctrl+C 停止）...")
+        if not self.game_window_title:
+            print("⚠️  未绑定游戏窗口，将截取全屏")
+        
+        stats = {"frames": 0, "ocr": 0, "answered": 0, "unknown": 0}
+        answered_hash = None     # 最近一次已处理题目区域的指纹
+        pending_hash = None      # 发生变化、等待稳定的指纹
+        stable_count = 0
+        last_question = None
+        started = time.perf_counter()
+        try:
+            while max_duration is None or time.perf_counter() - started < max_duration:
+                tick = time.perf_counter()
+                try:
+                    frame = self.take_screenshot(verbose=False)
+                except StopIteration:
+                    break
+                stats["frames"] += 1
+                region = self.question_region(frame)
+                current_hash = frame_hash(region)
+                
+                if answered_hash is not None and hash_distance(current_hash, answered_hash) <= threshold:
+                    pending_hash = None  # 仍是已处理的画面
+                elif pending_hash is None or hash_distance(current_hash, pending_hash) > threshold:
+                    pending_hash = current_hash
+                    stable_count = 0
+                else:
+                    stable_count += 1
+                
+                if pending_hash is not None and stable_count >= CONTINUOUS_CONFIG["stable_frames"]:
+                    answered_hash = pending_hash
+                    pending_hash = None
+                    stats["ocr"] += 1
+                    layout = self.read_layout(frame)
+                    text = layout["question"]
+                    if text and text != last_question:
+                        print(f"📝 识别到题目：{text}")
+                        last_question = text
+                        answer = self.find_correct_answer(text, learn=CONTINUOUS_CONFIG["auto_learn"])
+                        if answer:
+                            if self.click_answer(frame, layout, answer):
+                                metrics.record("answer_cycle", time.perf_counter() - tick)
+                            stats["answered"] += 1
+                        else:
+                            stats["unknown"] += 1
+                
+                remaining = interval - (time.perf_counter() - tick)
+                if remaining > 0:
+                    time.sleep(remaining)
+        except KeyboardInterrupt:
+            print("\n⏹️ 已停止连续答题")
+        
+        elapsed = time.perf_counter() - started
+        print(f"📊 连续答题统计：采样 {stats['frames']} 帧，识别 {stats['ocr']} 次，作答 {stats['answered']} 题，未知题目 {stats['unknown']} 道，用时 {elapsed:.1f} 秒")
+        self.add_memory(f"连续答题：作答{stats['answered']}题，未知{stats['unknown']}题", "system", "instruction")
+        return stats
+
+    def pipeline_answer_flow(self, max_duration=None):
+        """流水线答题：各阶段并发执行，截图不必等待上一帧识别和点击完成"""
+        if max_duration is None:
+            max_duration = PIPELINE_CONFIG["max_duration"]
+        print(f"\n🏭 启动流水线答题模式（{PIPELINE_CONFIG['fps']} 帧/秒，按 Ctrl+C 停止）...")
+        if not self.game_window_title:
+            print("⚠️  未绑定游戏窗口，将截取全屏")
+        
+        pipeline = AnswerPipeline(self, PIPELINE_CONFIG["fps"], PIPELINE_CONFIG["queue_size"])
+        started = time.perf_counter()
+        pipeline.start()
+        try:
+            while pipeline.running():
+                if max_duration is not None and time.perf_counter() - started >= max_duration:
+                    break
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            print("\n⏹️ 正在停止流水线...")
+        pipeline.stop()
+        elapsed = time.perf_counter() - started
+        
+        print("📊 流水线各阶段耗时：")
+        summary = pipeline.summary()
+        for name in AnswerPipeline.STAGES + ("total",):
+            if name in summary:
+                stat = summary[name]
+                label = "端到端" if name == "total" else name
+                print(f"   - {label}：{stat['count']} 次，平均 {stat['avg_ms']:.1f} ms，p95 {stat['p95_ms']:.1f} ms")
+        dropped = sum(pipeline.dropped.values())
+        print(f"   - 采样 {pipeline.counts['capture']} 帧（{pipeline.counts['capture'] / elapsed:.1f} 帧/秒），丢弃过期帧 {dropped} 帧，作答 {pipeline.counts['click']} 题")
+        self.add_memory(f"流水线答题：作答{pipeline.counts['click']}题，丢弃过期帧{dropped}帧", "system", "instruction")
+        return summary
+
+    def window_capture_backend(self, window_title):
+        """多窗口答题时每个窗口的截图后端：回放模式下各窗口独立回放，屏幕模式共用一个"""
+        if isinstance(self.capture_backend, ReplayCaptureBackend):
+            source = MULTI_WINDOW_CONFIG["replay_sources"].get(window_title, CAPTURE_CONFIG["replay_source"])
+            return ReplayCaptureBackend(source, CAPTURE_CONFIG["replay_loop"])
+        return self.capture_backend
+
+    def multi_window_answer_flow(self, windows=None, max_duration=None):
+        """多窗口答题：每个绑定窗口一个工作线程，共用题库索引和OCR引擎，点击统一排队执行"""
+        windows = windows or self.game_config.get("game_windows") or []
+        if not windows:
+            print("❌ 未绑定多个游戏窗口，请先使用 '绑定多个窗口' 指令")
+            return None
+        if max_duration is None:
+            max_duration = MULTI_WINDOW_CONFIG["max_duration"]
+        fps = MULTI_WINDOW_CONFIG["fps"]
+        print(f"\n🪟 启动多窗口答题（{len(windows)} 个窗口，每个 {fps} 帧/秒，按 Ctrl+C 停止）...")
+        
+        stop_event = threading.Event()
+        capture_lock = threading.Lock() if isinstance(self.capture_backend, ScreenCaptureBackend) else None
+        arbiter = ClickArbiter(self, self.capture_backend, capture_lock)
+        workers = [
+            WindowWorker(self, title, self.window_capture_backend(title), arbiter, stop_event, fps, capture_lock)
+            for title in windows
+        ]
+        arbiter.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(len(workers), thread_name_prefix="douxing-window") as pool:
+            futures = [pool.submit(worker.run) for worker in workers]
+            try:
+                while not all(f.done() for f in futures):
+                    if max_duration is not None and time.perf_counter() - started >= max_duration:
+                        break
+                    stop_event.wait(0.1)
+            except KeyboardInterrupt:
+                print("\n⏹️ 正在停止多窗口答题...")
+            stop_event.set()
+        arbiter.stop()
+        elapsed = time.perf_counter() - started
+        
+        print("📊 各窗口吞吐量：")
+        report = {}
+        for worker, future in zip(workers, futures):
+            stats = dict(worker.stats)
+            error = future.exception()
+            if error is not None:
+                stats["exception"] = repr(error)
+            window_elapsed = worker.elapsed or elapsed
+            latencies = sorted(worker.latencies)
+            waits = list(arbiter.waits.get(worker.window_title, []))
+            stats.update({
+                "clicks": arbiter.clicks.get(worker.window_title, 0),
+                "fps": stats["frames"] / window_elapsed if window_elapsed > 0 else 0.0,
+                "answers_per_min": stats["answered"] * 60 / window_elapsed if window_elapsed > 0 else 0.0,
+                "avg_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else 0.0,
+                "click_wait_ms": sum(waits) / len(waits) * 1000 if waits else 0.0
+            })
+            report[worker.window_title] = stats
+            print(f"   - {worker.window_title}：采样 {stats['frames']} 帧（{stats['fps']:.1f} 帧/秒），识别 {stats['ocr']} 次，"
+                  f"作答 {stats['answered']} 题（{stats['answers_per_min']:.1f} 题/分钟），未知 {stats['unknown']} 道，"
+                  f"识别到提交点击 平均 {stats['avg_ms']:.1f} ms / p95 {stats['p95_ms']:.1f} ms，点击排队 平均 {stats['click_wait_ms']:.1f} ms，"
+                  f"出错 {stats['errors']} 次")
+            if error is not None:
+                print(f"     ❌ 工作线程异常退出：{error!r}")
+        total = sum(stats["answered"] for stats in report.values())
+        print(f"   - 合计作答 {total} 题，用时 {elapsed:.1f} 秒")
+        self.add_memory(f"多窗口答题：{len(windows)}个窗口，共作答{total}题", "system", "instruction")
+        return report
+
     # ========== 主交互入口 ==========
     def start_chat_interaction(self):
         print("\n=====================================")
@@ -823,28 +4514,58 @@ class DouXingAI:
             user_input = input("你：")
             if user_input == "退出":
                 self.add_memory("豆星被用户关闭", "system", "instruction")
+                self.flush_persistence(verbose=False)
                 print(f"👋 {self.name} 已关闭，下次见！")
                 break
             self.parse_command(user_input)
 
 # ========== 运行豆星 ==========
 if __name__ == "__main__":
-    # 自动安装必要依赖
-    try:
-        import win32gui
-    except:
+    # 生成增量补丁（发布新版本时使用）：python 豆星_core.py --make-patch 旧文件 新文件 补丁文件
+    if sys.argv[1:2] == ["--make-patch"] and len(sys.argv) == 5:
+        with open(sys.argv[2], "rb") as f:
+            old_data = f.read()
+        with open(sys.argv[3], "rb") as f:
+            new_data = f.read()
+        patch_data = make_line_patch(old_data, new_data)
+        with open(sys.argv[4], "wb") as f:
+            f.write(patch_data)
+        print(json.dumps({
+            "base_hash": hashlib.sha256(old_data).hexdigest(),
+            "hash": hashlib.sha256(patch_data).hexdigest(),
+            "file_hash": hashlib.sha256(new_data).hexdigest(),
+            "size": len(patch_data)
+        }, ensure_ascii=False, indent=4))
+        sys.exit(0)
+    
+    # 快速启动：python 豆星_core.py --fast
+    fast_start = "--fast" in sys.argv[1:] or STARTUP_CONFIG["fast_start"]
+    
+    # 批量模式：python 豆星_core.py --batch 输入文件（- 表示标准输入） [--confirm yes|no] [--report 报告.json]
+    def option_value(name):
+        if name in sys.argv[1:-1]:
+            return sys.argv[sys.argv.index(name) + 1]
+        return None
+    batch_source = option_value("--batch")
+    if option_value("--confirm") in ("yes", "no"):
+        HEADLESS_CONFIG["confirm_policy"] = option_value("--confirm")
+    if batch_source:
+        fast_start = True
+    
+    # 自动安装必要依赖（只检查是否已安装，真正导入推迟到首次使用）
+    if importlib.util.find_spec("win32gui") is None:
         print("📦 正在安装窗口识别依赖...")
         os.system("pip install pywin32")
-        import win32gui
     
-    try:
-        import requests
-    except:
+    if importlib.util.find_spec("requests") is None:
         print("📦 正在安装网络请求依赖...")
         os.system("pip install requests")
-        import requests
     
     # 启动豆星
-    douxing = DouXingAI()
-    douxing.check_environment()
+    douxing = DouXingAI(fast_start=fast_start)
+    if batch_source:
+        douxing.run_batch(batch_source, option_value("--report"))
+        sys.exit(0)
+    if not fast_start:
+        douxing.check_environment()
     douxing.start_chat_interaction()
\ No newline at end of file